@@ -2,21 +2,31 @@
 # coding: utf-8
 
 
-from datetime import datetime
 import logging
+import time
 
-import requests
-from bs4 import BeautifulSoup
-from facepy import GraphAPI
-from pytz import timezone
-from slack import WebClient
+from .metrics import METRICS
+
+# The backends (requests, facepy and slack) are slow to import, and
+# are imported where they are used, so that importing the parser is cheap.
+# So is the scraper, with the HTML parser of the standard library.
 
 
 logger = logging.getLogger("lunchbot")
 
 
-def get_facebook_token(id, secret):
-    graph = GraphAPI()
+def _graph_api(token=False, fetcher=None):
+    """Make a GraphAPI, sharing the session and timeouts of fetcher if given"""
+    from facepy import GraphAPI
+    if fetcher is None:
+        return GraphAPI(token)
+    graph = GraphAPI(token, timeout=fetcher.timeout)
+    graph.session = fetcher.session
+    return graph
+
+
+def get_facebook_token(id, secret, fetcher=None):
+    graph = _graph_api(fetcher=fetcher)
     request = (
         'oauth/access_token?client_id=%s&client_secret=%s&grant_type=client_credentials'
     )
@@ -30,9 +40,9 @@ def get_facebook_token(id, secret):
         raise ValueError('Facebook GraphAPI token returned by Facebook of unknown type')
 
 
-def authenticated_graph(id, secret):
-    facebook_token = get_facebook_token(id, secret)
-    return GraphAPI(facebook_token)
+def authenticated_graph(id, secret, fetcher=None):
+    facebook_token = get_facebook_token(id, secret, fetcher)
+    return _graph_api(facebook_token, fetcher)
 
 
 def filter_messages(posts):
@@ -42,59 +52,80 @@ def filter_messages(posts):
 
 
 class SlackPoster:
-    def __init__(self, token, channels):
-        self.client = WebClient(token)
+    """Post messages to a set of Slack channels, concurrently"""
+
+    def __init__(self, token, channels, base_url=None, max_workers=8, max_retries=3):
+        from slack import WebClient
+        if base_url is None:
+            self.client = WebClient(token)
+        else:
+            self.client = WebClient(token, base_url=base_url)
         self.channels = channels
-
-    def post(self, message):
-        logger.info("Posting %r to %s", message, self.channels)
-        for ch in self.channels:
-            self.client.chat_postMessage(
-                channel=ch,
-                text=message,
-                as_user=False,
-                username='lunchbot',
-                icon_emoji=':spaghetti:',
-            )
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+    def post(self, message, channels=None):
+        """Post to the channels of the poster, or to channels if given"""
+        if channels is None:
+            channels = self.channels
+        logger.info("Posting %r to %s", message, channels)
+        from concurrent.futures import ThreadPoolExecutor
+        workers = max(1, min(self.max_workers, len(channels)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.post_to, ch, message) for ch in channels]
+        # Every channel has been tried, now raise the first failure if any:
+        for future in futures:
+            future.result()
+
+    def post_to(self, channel, message):
+        """Post to a single channel, waiting and retrying when rate limited"""
+        from slack.errors import SlackApiError
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.client.chat_postMessage(
+                    channel=channel,
+                    text=message,
+                    as_user=False,
+                    username='lunchbot',
+                    icon_emoji=':spaghetti:',
+                )
+            except SlackApiError as e:
+                limited = e.response.status_code == 429
+                METRICS.observe('lunchbot_slack_call_seconds', time.perf_counter() - start)
+                METRICS.inc('lunchbot_slack_calls_total', outcome='ratelimited' if limited else 'error')
+                if not limited or attempt == self.max_retries:
+                    raise
+                delay = float(e.response.headers.get('Retry-After', 1))
+                logger.warning('Rate limited posting to %s, retrying in %ss', channel, delay)
+                time.sleep(delay)
+            else:
+                METRICS.observe('lunchbot_slack_call_seconds', time.perf_counter() - start)
+                METRICS.inc('lunchbot_slack_calls_total', outcome='ok')
+                return response
 
 
 ## For scraping the facebook website
 
 
-def extract_post_text(elem):
-    """extract a post text from an html element"""
-    chunks = []
-    for e in elem.descendants:
-        if isinstance(e, str):
-            chunks.append(e.strip() + ' ')
-        elif e.name.lower() in {'br', 'p'}:
-            chunks.append('\n')
-    return ''.join(chunks).strip()
-
-
-def parse_post(content_wrapper):
-    """Parse a post element on the page
+def scrape_posts(page, fetcher=None, oldest=None):
+    """Scrape the posts of a facebook page, newest first
 
-    Returns a dict that looks enough like the post object from the API
-    to be a drop-in replacement
+    If the page is unchanged since the last time it was scraped back to
+    the same day with the same fetcher, the posts from then are returned
+    without parsing.
     """
-    timestamp = int(
-        content_wrapper.find(class_="timestampContent").parent.attrs['data-utime']
-    )
-    dt = datetime.fromtimestamp(timestamp).astimezone(timezone("UTC"))
-
-    content = content_wrapper.find(class_="userContent")
-    for item in content.find_all(class_="text_exposed_hide"):
-        item.decompose()
-    return {"created_time": dt.isoformat(), "message": extract_post_text(content)}
-
-
-def scrape_posts(page):
-    r = requests.get('https://facebook.com/{}/posts'.format(page))
-    r.raise_for_status()
-    html = BeautifulSoup(r.text, features="html.parser")
-    wrappers = html.find_all(class_='userContentWrapper')
-    if not wrappers:
+    from .fetch import Fetcher
+    from .scraper import VERSION, iter_posts
+
+    def parse(r):
+        if r.encoding is None:
+            r.encoding = 'utf-8'
+        return list(iter_posts(r.iter_content(chunk_size=16384, decode_unicode=True), oldest))
+
+    # Posts scanned back to another day are not the same:
+    parser = 'scraper/%d/%s' % (VERSION, oldest.date().isoformat() if oldest is not None else 'all')
+    posts = (fetcher or Fetcher()).get('https://facebook.com/{}/posts'.format(page), parse, parser)
+    if not posts:
         raise ValueError("Couldn't find posts. Did Facebook HTML change?")
-
-    return [parse_post(wrapper) for wrapper in wrappers]
+    return posts
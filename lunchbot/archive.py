@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""A compact archive of posts: one data file and an index of it.
+
+The data file holds the messages back to back as UTF-8, and is memory
+mapped, so a message is only read and decoded when asked for. The index,
+at the path of the data file with INDEX_SUFFIX added, is JSON, with the
+name, created time, offset and length of each post, oldest first, and
+any metadata about it, like the week of a menu posted in another week.
+
+Opening an archive is two opens and a small JSON load, instead of a
+glob and an open for each post in a directory of messages.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import io
+import json
+import logging
+import mmap
+import os
+
+
+logger = logging.getLogger('lunchbot')
+
+INDEX_SUFFIX = '.index'
+
+# Bump when changing the layout of the index:
+VERSION = 1
+
+Entry = collections.namedtuple('Entry', ('name', 'created_time', 'offset', 'length', 'meta'))
+
+
+def is_archive(path):
+    return os.path.isfile(path + INDEX_SUFFIX)
+
+
+class PostArchive(object):
+    """A memory mapped archive of posts, with entries by name"""
+
+    def __init__(self, path):
+        self.path = path
+        with io.open(path + INDEX_SUFFIX, encoding='utf8') as f:
+            index = json.load(f)
+        if index.get('version') != VERSION:
+            raise ValueError('Unknown version of archive index %s' % (path + INDEX_SUFFIX))
+        self.entries = [
+            Entry(post['name'], post['created_time'], post['offset'], post['length'], post.get('meta', {}))
+            for post in index['posts']
+        ]
+        self.by_name = dict((entry.name, entry) for entry in self.entries)
+        self.file = io.open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # An empty file can not be mapped:
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def message(self, entry):
+        """Decode the message of an entry, or of the entry with that name,
+        straight from the mapped data file"""
+        if not isinstance(entry, Entry):
+            entry = self.by_name[entry]
+        with memoryview(self.data) as data:
+            with data[entry.offset:entry.offset + entry.length] as body:
+                return str(body, 'utf8')
+
+    def post(self, entry):
+        """Get an entry as a post, like those of the Graph API"""
+        if not isinstance(entry, Entry):
+            entry = self.by_name[entry]
+        return dict(message=self.message(entry), created_time=entry.created_time)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _entries(f, posts):
+    """Write the messages of posts to f, and get their index entries"""
+    entries = []
+    for name, created_time, message, meta in posts:
+        body = message.encode('utf8')
+        entry = collections.OrderedDict([
+            ('name', name), ('created_time', created_time), ('offset', f.tell()), ('length', len(body)),
+        ])
+        if meta:
+            entry['meta'] = meta
+        entries.append(entry)
+        f.write(body)
+    return entries
+
+
+def _write_index(path, entries):
+    with io.open(path + INDEX_SUFFIX + '.tmp', 'w', encoding='utf8') as f:
+        # One post to a line, so that changes to the index diff well:
+        f.write('{"version": %d, "posts": [\n' % VERSION)
+        f.write(',\n'.join(json.dumps(entry, ensure_ascii=False) for entry in entries))
+        f.write('\n]}\n')
+    os.rename(path + INDEX_SUFFIX + '.tmp', path + INDEX_SUFFIX)
+
+
+def write_archive(path, posts):
+    """Write (name, created_time, message, meta) of each post to an archive
+    at path, replacing any archive there"""
+    with io.open(path + '.tmp', 'wb') as f:
+        entries = _entries(f, posts)
+    os.rename(path + '.tmp', path)
+    _write_index(path, entries)
+    return len(entries)
+
+
+def append_archive(path, posts):
+    """Add (name, created_time, message, meta) of each post to the end of
+    the archive at path, or of a new one if there is none
+
+    The messages are appended to the data file, so that the offsets of
+    those already there, and readers mapping it, are left as they are,
+    and only then is the index replaced.
+    """
+    entries = []
+    if is_archive(path):
+        with io.open(path + INDEX_SUFFIX, encoding='utf8') as f:
+            entries = json.load(f, object_pairs_hook=collections.OrderedDict)['posts']
+    with io.open(path, 'ab') as f:
+        # Past anything written by an append that did not get to its index:
+        f.seek(0, os.SEEK_END)
+        added = _entries(f, posts)
+    _write_index(path, entries + added)
+    return len(added)
+
+
+def archived_posts(path):
+    """Get (name, created_time, message, meta) of each post in the archive
+    at path, to write them back with others"""
+    if not is_archive(path):
+        return []
+    with PostArchive(path) as archive:
+        return [
+            (entry.name, entry.created_time, archive.message(entry), entry.meta)
+            for entry in archive
+        ]
+
+
+def import_posts(source, path, meta=None):
+    """Write the posts of a directory of messages or a file of JSON lines
+    to an archive at path. meta is metadata by post name."""
+    from .backfill import read_post, scan_posts
+    meta = meta or {}
+    posts = []
+    for _, (filename, key) in scan_posts(source):
+        post = read_post((filename, key))
+        if key is None:
+            name = os.path.basename(filename)
+        elif is_archive(source):
+            name = key
+        else:
+            name = post.get('id') or post['created_time']
+        post_meta = meta.get(name)
+        if post_meta is None and post.get('kind'):
+            # As kept in the JSON lines that ingest wrote before archives:
+            post_meta = dict(kind=post['kind'])
+        posts.append((name, post['created_time'], post['message'], post_meta))
+    count = write_archive(path, posts)
+    logger.info('Archived %d posts from %s in %s', count, source, path)
+    return count
+
+
+def run_import(arguments):
+    count = import_posts(arguments.source, arguments.archive)
+    print('Archived %d posts in %s' % (count, arguments.archive))
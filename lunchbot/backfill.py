@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Compute the menus of every weekday in a range of dates from an archive of posts.
+
+Posts are grouped by the week they were posted in, and each week is parsed
+once, in a pool of worker processes. The menus of a week are then looked up
+in the weeks parsed around it, so only a few weeks of posts are held in
+memory at a time, and results are written out as soon as they are known.
+
+The archive is either a PostArchive, like tests/historical.posts, a file
+of posts as JSON lines, or a directory of messages named by the date they
+were posted.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import datetime
+import glob
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from functools import lru_cache
+
+from pytz import timezone
+
+from .archive import INDEX_SUFFIX, PostArchive, is_archive
+from .config import DISHES_PATH, SITES
+from .dishes import open_dish_index
+from .main import MENU_WINDOW_DAYS, TIME_FORMAT, PostIndex, get_menus, parse_post
+from .segmenter import compile_floor_headers
+
+
+logger = logging.getLogger('lunchbot')
+
+TIMEZONE = timezone('Europe/Oslo')
+
+# Weeks of posts needed on each side of a week to look up its menus:
+SPAN = MENU_WINDOW_DAYS // 7 + 1
+
+
+def monday(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def scan_posts(path):
+    """Get (date posted, source) of each post in the archive at path
+
+    A source is (path, name) for a PostArchive, (path, offset) for a JSON
+    lines file, and (path, None) for a message file. Messages are read from
+    their source when parsed.
+    """
+    if is_archive(path):
+        for entry in open_archive(path):
+            dt = datetime.datetime.strptime(entry.created_time, TIME_FORMAT)
+            yield dt.astimezone(TIMEZONE).date(), (path, entry.name)
+        return
+    if os.path.isdir(path):
+        for fn in sorted(glob.glob(os.path.join(path, '*.txt'))):
+            stamp = os.path.basename(fn).split('-')[0]
+            yield datetime.datetime.strptime(stamp, '%y%m%d').date(), (fn, None)
+        return
+    with io.open(path, 'rb') as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            post = json.loads(line.decode('utf8'))
+            if 'message' not in post:
+                continue
+            dt = datetime.datetime.strptime(post['created_time'], TIME_FORMAT)
+            yield dt.astimezone(TIMEZONE).date(), (path, offset)
+
+
+@lru_cache(8)
+def _open_archive(path, mtime):
+    return PostArchive(path)
+
+
+def open_archive(path):
+    """Get the archive at path, kept open as posts are read one by one, and
+    opened again once its index is replaced, as by ingest"""
+    return _open_archive(path, os.stat(path + INDEX_SUFFIX).st_mtime_ns)
+
+
+def read_post(source):
+    path, offset = source
+    if is_archive(path):
+        return open_archive(path).post(offset)
+    if offset is None:
+        stamp = os.path.basename(path).split('-')[0]
+        created = TIMEZONE.localize(datetime.datetime.strptime(stamp, '%y%m%d'))
+        with io.open(path, encoding='utf8') as f:
+            return dict(message=f.read(), created_time=created.strftime(TIME_FORMAT))
+    with io.open(path, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline().decode('utf8'))
+
+
+def parse_week(args):
+    """Read and parse the posts of a week, in a worker"""
+    sources, floor_headers = args
+    headers = compile_floor_headers(floor_headers)
+    posts = [read_post(source) for source in sources]
+    return posts, [parse_post(post, headers=headers) for post in posts]
+
+
+def backfill(path, start, end, output, workers=None, dishes=None, site=None):
+    """Write the menu of each weekday from start to end to output as JSON lines
+
+    Posts are parsed with the floor headers of site. If a DishIndex is
+    given, the dishes of the menus are added to it.
+    """
+    if site is None:
+        site = SITES[0]
+    first = monday(start) - datetime.timedelta(weeks=SPAN)
+    last = monday(end) + datetime.timedelta(weeks=SPAN)
+    weeks = collections.defaultdict(list)
+    for day, source in scan_posts(path):
+        if first <= day < last + datetime.timedelta(weeks=1):
+            weeks[monday(day)].append(source)
+    mondays = [first + datetime.timedelta(weeks=i) for i in range((last - first).days // 7 + 1)]
+    logger.info('Backfilling %s to %s from %d posts', start, end, sum(map(len, weeks.values())))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        parsed_weeks = pool.imap(parse_week, [(weeks.pop(m, []), site.floor_headers) for m in mondays])
+        around = collections.deque(maxlen=2 * SPAN + 1)
+        for i, parsed_week in enumerate(parsed_weeks):
+            around.append(parsed_week)
+            if len(around) < around.maxlen:
+                continue
+            index = PostIndex(
+                [post for posts, _ in around for post in posts],
+                parsed=[parsed for _, parsed_posts in around for parsed in parsed_posts],
+            )
+            week = mondays[i - SPAN]
+            for weekday in range(5):
+                day = week + datetime.timedelta(days=weekday)
+                if not start <= day <= end:
+                    continue
+                date = TIMEZONE.localize(datetime.datetime.combine(day, datetime.time(12)))
+                menu = get_menus(None, date, index=index)
+                record = collections.OrderedDict([('date', day.isoformat())])
+                record.update(menu._asdict())
+                output.write(json.dumps(record) + '\n')
+                if dishes is not None:
+                    dishes.add_menu(day, menu, site.name)
+            output.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_backfill(arguments):
+    spooled = None
+    path = arguments.posts
+    if path == '-':
+        # Spool stdin to a file, so that workers can read posts from it:
+        spooled = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        with spooled:
+            shutil.copyfileobj(sys.stdin.buffer, spooled)
+        path = spooled.name
+    sites = dict((site.name, site) for site in SITES)
+    if arguments.site is not None and arguments.site not in sites:
+        raise ValueError('Unknown site %r, expected one of %s' % (arguments.site, ', '.join(sites)))
+    site = sites.get(arguments.site, SITES[0])
+    dishes = open_dish_index(DISHES_PATH) if arguments.index else None
+    try:
+        if arguments.output == '-':
+            backfill(path, arguments.start, arguments.end, sys.stdout, arguments.workers, dishes, site)
+        else:
+            with io.open(arguments.output, 'w', encoding='utf8') as output:
+                backfill(path, arguments.start, arguments.end, output, arguments.workers, dishes, site)
+    finally:
+        if dishes is not None:
+            dishes.close()
+        if spooled is not None:
+            os.remove(spooled.name)
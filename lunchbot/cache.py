@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""On-disk cache of parsed posts, keyed by a hash of the post message.
+
+Keys also include the parser version, so that a change to the parser never
+serves results from the old one. Entries from other parser versions are
+dropped when the cache is opened.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+logger = logging.getLogger('lunchbot')
+
+# Returned by ParseCache.get when a message is not cached, as None is a
+# valid cached value (a post that is not a menu).
+MISSING = object()
+
+
+class ParseCache(object):
+    """A SQLite backed cache of JSON values keyed by message content"""
+
+    def __init__(self, path, version, max_entries=1000, max_age=30 * 24 * 3600):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS parsed ('
+            ' key TEXT PRIMARY KEY,'
+            ' version TEXT NOT NULL,'
+            ' created REAL NOT NULL,'
+            ' accessed REAL NOT NULL,'
+            ' value TEXT NOT NULL)'
+        )
+        self.db.execute('DELETE FROM parsed WHERE version != ?', (version,))
+        self.evict()
+        self.db.commit()
+
+    def key(self, message):
+        h = hashlib.sha256(self.version.encode('utf8'))
+        h.update(message.encode('utf8'))
+        return h.hexdigest()
+
+    def get(self, message):
+        """Get the cached value for a message, or MISSING"""
+        key = self.key(message)
+        row = self.db.execute('SELECT value FROM parsed WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return MISSING
+        self.db.execute('UPDATE parsed SET accessed = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, message, value):
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO parsed (key, version, created, accessed, value)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (self.key(message), self.version, now, now, json.dumps(value)),
+        )
+
+    def evict(self):
+        """Drop entries older than max_age, then the least recently used
+        entries beyond max_entries."""
+        if self.max_age:
+            self.db.execute('DELETE FROM parsed WHERE created < ?', (time.time() - self.max_age,))
+        if self.max_entries:
+            self.db.execute(
+                'DELETE FROM parsed WHERE key NOT IN'
+                ' (SELECT key FROM parsed ORDER BY accessed DESC LIMIT ?)',
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM parsed').fetchone()[0]
+
+    def flush(self):
+        """Evict old entries, and write changes to disk"""
+        self.evict()
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def open_cache(path, version, **kwargs):
+    """Open the cache at path, or return None if it can not be opened"""
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    try:
+        return ParseCache(path, version, **kwargs)
+    except sqlite3.Error:
+        logger.exception('Could not open parse cache at %s, continuing without', path)
+        return None
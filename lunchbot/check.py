@@ -5,6 +5,8 @@ def log_menu(message):
 
 
 if __name__ == '__main__':
+    import sys
     from .main import main
 
-    main(args=['--verbose'], post_menu=log_menu)
+    # E.g. --saved-page page.html --profile-regex, to profile without posting:
+    main(args=['--verbose'] + sys.argv[1:], post_menu=log_menu)
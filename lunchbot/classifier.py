@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Tell what kind of menu post a message is, in one pass over it.
+
+Most posts on the page are not menus. A menu has a header line with one
+of HEADER_KEYWORDS, so a message without any of them as a word is
+rejected with one search, before any other pattern is run. The rest are
+segmented once, and labeled from the layout of their segments:
+
+    weekly-combined       a week header, then a section for each floor
+    weekly-single-floor   a week header, then the section of one floor
+    daily-combined        a date header, then a section for each floor
+    by-day-first          a week header, then a block for each weekday
+    not-a-menu            anything else
+
+The segments are kept with the label, so that a post is extracted from
+them straight away, by the extractor of its kind.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import re
+
+from .segmenter import floor_headers, segment
+
+
+WEEKLY_COMBINED = 'weekly-combined'
+WEEKLY_SINGLE_FLOOR = 'weekly-single-floor'
+DAILY_COMBINED = 'daily-combined'
+BY_DAY_FIRST = 'by-day-first'
+NOT_A_MENU = 'not-a-menu'
+
+KINDS = (WEEKLY_COMBINED, WEEKLY_SINGLE_FLOOR, DAILY_COMBINED, BY_DAY_FIRST, NOT_A_MENU)
+
+# Every week header has uke or week, and every date header meny or menu
+# (menyer and menus included), in any case. As words, so that bruke or
+# trukket is not taken for uke:
+HEADER_KEYWORDS = re.compile(r'\b(?:meny(?:er)?|menus?|uke|week)\b', flags=re.IGNORECASE)
+
+# floors are the floors of the sections, in the order they are posted:
+Classification = collections.namedtuple('Classification', ('kind', 'floors', 'segments'))
+
+REJECTED = Classification(NOT_A_MENU, (), None)
+
+
+def may_be_menu(message):
+    """Tell if a message has any of the keywords of a menu header"""
+    return HEADER_KEYWORDS.search(message) is not None
+
+
+def classify(message, budget=None, headers=floor_headers):
+    """Classify a message as one of KINDS
+
+    Floor header lines are found with headers, as from
+    compile_floor_headers. Raises ParseTimeout if segmenting takes longer
+    than budget seconds.
+    """
+    if not may_be_menu(message):
+        return REJECTED
+    segments = segment(message, budget, headers)
+    header = segments.header
+    if header is None:
+        return REJECTED
+    floors = tuple(segments.floors)
+    if header.kind == 'daily':
+        if len(floors) < 2:
+            return Classification(NOT_A_MENU, floors, segments)
+        return Classification(DAILY_COMBINED, floors, segments)
+    if len(floors) > 1:
+        return Classification(WEEKLY_COMBINED, floors, segments)
+    if floors:
+        return Classification(WEEKLY_SINGLE_FLOOR, floors, segments)
+    return Classification(BY_DAY_FIRST, (), segments)
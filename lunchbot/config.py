@@ -3,17 +3,91 @@
 
 from __future__ import print_function
 
-import argparse
+import collections
 import configparser
 import os
 
 
-parser = argparse.ArgumentParser(
-    description='A bot for slack that fetches and parses the lunch menu for Technopolis IT Fornebu'
-)
-parser.add_argument(
-    "-v", "--verbose", help="increase output verbosity", action="store_true"
-)
+def get_parser():
+    """Build the command line parser, only when the command line is parsed"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='A bot for slack that fetches and parses the lunch menu for Technopolis IT Fornebu'
+    )
+    parser.add_argument(
+        "-v", "--verbose", help="increase output verbosity", action="store_true"
+    )
+    parser.add_argument(
+        "--daemon", help="keep running, and post at the times set in [Schedule]", action="store_true"
+    )
+    parser.add_argument(
+        "--profile", metavar='FILE',
+        help="profile the run, and write the stats to FILE for pstats, snakeviz or flameprof",
+    )
+    parser.add_argument(
+        "--profile-regex", action="store_true",
+        help="time each pattern, and print their calls, total time and slowest input at exit",
+    )
+    parser.add_argument(
+        "--saved-page", metavar='FILE',
+        help="read posts from a saved copy of the facebook page instead of fetching it",
+    )
+    commands = parser.add_subparsers(dest='command')
+
+    backfill = commands.add_parser(
+        'backfill', help='print the menus of every weekday in a range of dates as JSON lines'
+    )
+    backfill.add_argument('--from', dest='start', type=_date, required=True, help='first date, as YYYY-MM-DD')
+    backfill.add_argument('--to', dest='end', type=_date, required=True, help='last date, as YYYY-MM-DD')
+    backfill.add_argument(
+        '--posts', default='-',
+        help='an archive, posts as JSON lines, or a directory of YYMMDD-*.txt messages (default: stdin)',
+    )
+    backfill.add_argument('--output', default='-', help='file to write to (default: stdout)')
+    backfill.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    backfill.add_argument('--index', action='store_true', help='also add the dishes to the dish index')
+    backfill.add_argument('--site', help='the site the posts are from (default: the first site)')
+
+    search = commands.add_parser('search', help='search the dishes of past menus')
+    search.add_argument('query', nargs='+', help='words of the dish')
+    search.add_argument('--floor', choices=('first', 'third'), help='only dishes served on this floor')
+    search.add_argument('--site', help='only dishes served at this site')
+    search.add_argument('--limit', type=int, default=20, help='how many dishes to list (default: 20)')
+    search.add_argument('--count', action='store_true', help='count the days it was served instead')
+
+    archive = commands.add_parser(
+        'archive', help='write posts from a directory or a JSON lines file to a compact archive'
+    )
+    archive.add_argument('source', help='directory of YYMMDD-*.txt messages, or posts as JSON lines')
+    archive.add_argument('archive', help='archive to write, replacing any there')
+
+    ingest = commands.add_parser('ingest', help='add the posts since the last ingest to the archive of posts')
+    ingest.add_argument(
+        '--archive', help='compact archive of posts to add to, as the archive command writes (default: archive of the site, or in [Ingest])'
+    )
+    ingest.add_argument('--site', help='the site to get the posts of (default: the first site)')
+
+    serve = commands.add_parser('serve', help='serve the menus as JSON over HTTP')
+    serve.add_argument('--host', help='address to listen on (default: host in [Serve])')
+    serve.add_argument('--port', type=int, help='port to listen on (default: port in [Serve])')
+
+    patterns = commands.add_parser('patterns', help='report how often each pattern variant matches')
+    patterns.add_argument('--historical', help='first count the matches in an archive, directory or file of posts')
+    patterns.add_argument(
+        '--since', type=_date, help='variants with no match since this date are dead (default: a year before the last match)'
+    )
+    return parser
+
+
+def _date(value):
+    import datetime
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def __getattr__(name):
+    if name == 'parser':
+        return get_parser()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -37,7 +111,131 @@ FACEBOOK_ID = config.get(
     'Facebook', 'id', fallback=os.environ.get("FACEBOOK_API_ID", None)
 )
 
+# Messages are queued here before posting, so that none is posted twice.
+# Set to an empty value to post directly:
+OUTBOX_PATH = config.get('Slack', 'outbox', fallback='~/.lunchbot-outbox.sqlite')
+
+# Archive of posts, a data file and its .index, kept up to date by the
+# ingest command. JSON lines written by ingest before are converted:
+INGEST_PATH = config.get('Ingest', 'archive', fallback='~/.lunchbot-posts')
+
 SLACK_CHANNELS = [
     c.strip()
     for c in config.get('Slack', 'channels', fallback='lunchbotdev').split(',')
 ]
+
+# A canteen to post the menu of: its facebook page, the channels to post to,
+# the (floor, pattern) of its floor header lines, None for the defaults, and
+# the archive its posts are ingested to, if any.
+Site = collections.namedtuple(
+    'Site', ('name', 'page', 'channels', 'floor_headers', 'archive'), defaults=(None,)
+)
+
+
+def _channels(value):
+    return [c.strip() for c in value.split(',') if c.strip()]
+
+
+def _sites():
+    """Read sites from [Site:<name>] sections, or the single default site"""
+    sites = []
+    for section in config.sections():
+        if not section.startswith('Site:'):
+            continue
+        headers = tuple(
+            (floor, config.get(section, floor + '-floor', fallback=None))
+            for floor in ('first', 'third')
+        )
+        sites.append(Site(
+            section[len('Site:'):].strip(),
+            config.get(section, 'page'),
+            _channels(config.get(section, 'channels', fallback='')) or SLACK_CHANNELS,
+            headers if any(source for _, source in headers) else None,
+            config.get(section, 'archive', fallback=None),
+        ))
+    return sites or [Site('technopolis', 'technopolisitfornebu', SLACK_CHANNELS, None, INGEST_PATH)]
+
+
+SITES = _sites()
+
+# A Slack workspace to post menus to: its token, its channels, None for the
+# channels of each site, the names of the sites to post the menus of, all
+# if empty, and the floor to post the menu of, None for both.
+Workspace = collections.namedtuple('Workspace', ('name', 'token', 'channels', 'sites', 'floor'))
+
+
+def _workspaces():
+    """Read workspaces from [Workspace:<name>] sections, or the single
+    default workspace of [Slack]"""
+    workspaces = []
+    for section in config.sections():
+        if not section.startswith('Workspace:'):
+            continue
+        floor = config.get(section, 'floor', fallback=None) or None
+        if floor not in (None, 'first', 'third'):
+            raise ValueError('Unknown floor %r in [%s], expected first or third' % (floor, section))
+        workspaces.append(Workspace(
+            section[len('Workspace:'):].strip(),
+            config.get(section, 'token', fallback=None),
+            _channels(config.get(section, 'channels', fallback='')) or None,
+            tuple(_channels(config.get(section, 'sites', fallback=''))),
+            floor,
+        ))
+    return workspaces or [Workspace('default', SLACK_TOKEN, None, (), None)]
+
+
+WORKSPACES = _workspaces()
+
+# How many sites to fetch at the same time:
+SITE_WORKERS = config.getint('General', 'site-workers', fallback=4)
+
+# Seconds allowed for parsing a single post before it is skipped:
+PARSE_BUDGET = config.getfloat('General', 'parse-budget', fallback=0.5)
+
+# Cache of parsed posts, set path to an empty value to disable:
+CACHE_PATH = config.get('Cache', 'path', fallback='~/.lunchbot-cache.sqlite')
+CACHE_MAX_ENTRIES = config.getint('Cache', 'max-entries', fallback=1000)
+CACHE_MAX_AGE = config.getfloat('Cache', 'max-age-days', fallback=30) * 24 * 3600
+
+# Fetching of pages, and the cache of the posts parsed from them (set
+# cache-path to an empty value to disable the cache):
+FETCH_CONNECT_TIMEOUT = config.getfloat('Fetch', 'connect-timeout', fallback=5)
+FETCH_READ_TIMEOUT = config.getfloat('Fetch', 'read-timeout', fallback=20)
+FETCH_CACHE_PATH = config.get('Fetch', 'cache-path', fallback='~/.lunchbot-responses.sqlite')
+FETCH_CACHE_TTL = config.getfloat('Fetch', 'ttl-minutes', fallback=5) * 60
+
+# Index of the dishes of past menus, set path to an empty value to disable:
+DISHES_PATH = config.get('Dishes', 'path', fallback='~/.lunchbot-dishes.sqlite')
+
+# Hit statistics of the pattern variants, set path to an empty value to disable:
+STATS_PATH = config.get('Stats', 'path', fallback='~/.lunchbot-stats.sqlite')
+
+# File to write metrics to in the Prometheus text format, e.g. in the
+# directory of the node exporter's textfile collector. Not written if empty.
+METRICS_PATH = config.get('Metrics', 'textfile', fallback='')
+
+# Where the serve command listens, and how often it fetches the posts again:
+SERVE_HOST = config.get('Serve', 'host', fallback='127.0.0.1')
+SERVE_PORT = config.getint('Serve', 'port', fallback=8080)
+SERVE_REFRESH_MINUTES = config.getfloat('Serve', 'refresh-minutes', fallback=15)
+
+# Where to get the posts of a site from, in order of preference. The next
+# source is also tried when the ones before have not given a menu within
+# hedge-seconds, and the first menu from any source within timeout-seconds
+# is used:
+SOURCE_ORDER = [
+    name.strip()
+    for name in config.get('Sources', 'order', fallback='scraper, graph, archive').split(',')
+    if name.strip()
+]
+SOURCE_HEDGE_SECONDS = config.getfloat('Sources', 'hedge-seconds', fallback=5)
+SOURCE_TIMEOUT = config.getfloat('Sources', 'timeout-seconds', fallback=60)
+
+# Times to post at in daemon mode, as HH:MM, for all channels or per channel:
+POST_TIME = config.get('Schedule', 'time', fallback='10:30')
+CHANNEL_POST_TIMES = dict(
+    (c, config.get('Schedule', c, fallback=POST_TIME))
+    for channels in [site.channels for site in SITES] + [w.channels or [] for w in WORKSPACES]
+    for c in channels
+)
+PREFETCH_MINUTES = config.getfloat('Schedule', 'prefetch-minutes', fallback=10)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Long running mode, posting the menu at scheduled times.
+
+The process, its Slack clients and HTTP session are kept warm between
+posts. The menus of all sites posting at a time are fetched and parsed a
+little before it, so that posting is all that is left to do when the time
+comes.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import datetime
+import logging
+import threading
+import time
+
+from pytz import timezone
+
+from .config import CHANNEL_POST_TIMES, PREFETCH_MINUTES, SITES, SITE_WORKERS, STATS_PATH
+from .fetch import make_session
+from .main import (
+    Menu, Target, check_config, deliver, fetch_site_menu, for_each_site, record_run, site_targets, slack_clients,
+)
+from .metrics import METRICS
+from .dishes import record_menu
+from .stats import load_stats, save_stats
+
+
+logger = logging.getLogger('lunchbot')
+
+TIMEZONE = timezone('Europe/Oslo')
+
+# Sleep in one go until this many seconds before a deadline, then in small steps:
+COARSE_MARGIN = 0.05
+FINE_STEP = 0.001
+
+
+def parse_time(value):
+    """Parse a time of day given as HH:MM"""
+    hour, minute = value.strip().split(':')
+    return datetime.time(int(hour), int(minute))
+
+
+def group_by_time(channel_times):
+    """Map each posting time to the channels posting at that time"""
+    schedule = collections.OrderedDict()
+    for channel, value in sorted(channel_times.items(), key=lambda item: parse_time(item[1])):
+        schedule.setdefault(parse_time(value), []).append(channel)
+    return schedule
+
+
+def next_slot(schedule, now):
+    """Get the next (datetime, channels) to post at after now, on a weekday"""
+    for days_ahead in range(8):
+        day = (now + datetime.timedelta(days=days_ahead)).date()
+        if day.weekday() >= 5:
+            continue
+        for at, channels in schedule.items():
+            slot = TIMEZONE.localize(datetime.datetime.combine(day, at))
+            if slot > now:
+                return slot, channels
+    raise ValueError('Empty schedule')
+
+
+class Daemon(object):
+    def __init__(self, schedule, post_menu=None, prefetch=PREFETCH_MINUTES * 60, sites=SITES):
+        self.schedule = schedule
+        self.prefetch = prefetch
+        self.sites = sites
+        self.stopped = threading.Event()
+        self.session = make_session(SITE_WORKERS)
+        # One warm client per workspace, for all of its sites and times:
+        clients = slack_clients() if post_menu is None else None
+        self.targets = {}
+        for at, channels in schedule.items():
+            for site in sites:
+                if post_menu is None:
+                    targets = site_targets(site, clients, channels)
+                elif [c for c in channels if c in site.channels]:
+                    targets = [Target('local', post_menu, None)]
+                else:
+                    targets = []
+                if targets:
+                    self.targets[(at, site.name)] = targets
+
+    def now(self):
+        return datetime.datetime.now(TIMEZONE)
+
+    def sleep_until(self, deadline):
+        """Sleep until deadline, returning False if stopped before that"""
+        while not self.stopped.is_set():
+            remaining = (deadline - self.now()).total_seconds()
+            if remaining <= 0:
+                return True
+            if remaining > COARSE_MARGIN:
+                self.stopped.wait(remaining - COARSE_MARGIN)
+            else:
+                time.sleep(min(remaining, FINE_STEP))
+        return False
+
+    def fetch(self, date, sites):
+        """Fetch the menus of sites for date by site name, None on failure"""
+        def fetch_site(site):
+            try:
+                return fetch_site_menu(site, date, self.session)
+            except Exception:
+                logger.exception('Failed to fetch menu of %s for %s', site.name, date)
+                return None
+        return for_each_site(sites, fetch_site)
+
+    def run_once(self):
+        """Wait for the next slot, and post the menus in it"""
+        slot, channels = next_slot(self.schedule, self.now())
+        sites = [site for site in self.sites if (slot.time(), site.name) in self.targets]
+        logger.info('Next post at %s to %s', slot, channels)
+        if not self.sleep_until(slot - datetime.timedelta(seconds=self.prefetch)):
+            return
+        menus = self.fetch(slot, sites)
+        if not self.sleep_until(slot):
+            return
+        start = time.perf_counter()
+        failed = [site for site in sites if menus[site.name] is None]
+        if failed:
+            # Prefetch failed, try once more before giving up:
+            menus.update(self.fetch(slot, failed))
+        success = not [site for site in sites if menus[site.name] is None]
+        for site in sites:
+            menu = menus[site.name] or Menu()
+            try:
+                with METRICS.timer('post', site=site.name):
+                    deliver(menu, self.targets[(slot.time(), site.name)])
+            except Exception:
+                logger.exception('Failed to post menu of %s for %s', site.name, slot)
+                success = False
+                continue
+            record_menu(slot.date(), menu, site.name)
+        logger.info('Posted menus for %s, %.3fs late', slot, (self.now() - slot).total_seconds())
+        save_stats(STATS_PATH)
+        # From the posting time, as the prefetch is done ahead of it:
+        record_run(start, success)
+
+    def run_forever(self):
+        try:
+            while not self.stopped.is_set():
+                self.run_once()
+        finally:
+            self.session.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_daemon(post_menu=None):
+    if post_menu is None:
+        check_config()
+    schedule = group_by_time(CHANNEL_POST_TIMES)
+    load_stats(STATS_PATH)
+    logger.info('Starting daemon with schedule %s', schedule)
+    daemon = Daemon(schedule, post_menu=post_menu)
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopping daemon')
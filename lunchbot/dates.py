@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Norwegian and English names of months and weekdays.
+
+Menus are posted in either language, with the odd typo, so the names are
+looked up in tables built once at import, rather than parsed with
+strptime under a process global Norwegian locale. The tables are only
+read after import, so they are safe to share between threads.
+"""
+
+from __future__ import print_function, unicode_literals
+
+
+# Names of each weekday, Monday first:
+WEEKDAY_NAMES = (
+    ('mandag', 'monday'),
+    ('tirsdag', 'tuesday'),
+    ('onsdag', 'wednesday'),
+    ('torsdag', 'thursday'),
+    ('fredag', 'friday'),
+    ('lørdag', 'saturday'),
+    ('søndag', 'sunday'),
+)
+
+# Names and abbreviations of each month, January first:
+MONTH_NAMES = (
+    ('januar', 'january', 'jan'),
+    ('februar', 'february', 'feb'),
+    ('mars', 'march', 'mar'),
+    ('april', 'apr'),
+    ('mai', 'may'),
+    ('juni', 'june', 'jun'),
+    ('juli', 'july', 'jul'),
+    ('august', 'aug'),
+    ('september', 'sept', 'sep'),
+    ('oktober', 'october', 'okt', 'oct'),
+    ('november', 'nov'),
+    ('desember', 'december', 'des', 'dec'),
+)
+
+# Misspellings of weekdays seen in posts, and their weekday. Only those
+# more than one typo from any name, as the segmenter finds the rest:
+WEEKDAY_MISSPELLINGS = (
+    ('wendsday', 2),
+)
+
+WEEKDAYS = dict(
+    (name, weekday) for weekday, names in enumerate(WEEKDAY_NAMES) for name in names
+)
+WEEKDAYS.update(WEEKDAY_MISSPELLINGS)
+MONTHS = dict(
+    (name, month) for month, names in enumerate(MONTH_NAMES, 1) for name in names
+)
+
+
+def _normalize(word):
+    return word.strip(' \t.,:').lower()
+
+
+def weekday_number(word):
+    """Get the weekday of a name, 0 for Monday, or None if it is not one"""
+    if not word:
+        return None
+    return WEEKDAYS.get(_normalize(word))
+
+
+def month_number(word):
+    """Get the month of a name, 1 for January, or None if it is not one"""
+    if not word:
+        return None
+    return MONTHS.get(_normalize(word))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Dishes of past menus, and an inverted index to search them.
+
+Each line of a menu is a dish, tagged with the date, weekday and floor it
+was served on. The index maps each word of a dish to the dishes it is in,
+and is kept in SQLite, so that it can be updated as menus are found and
+searched without parsing any posts.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import datetime
+import logging
+import os
+import re
+import sqlite3
+
+from .config import DISHES_PATH
+
+
+logger = logging.getLogger('lunchbot')
+
+Dish = collections.namedtuple('Dish', ('date', 'weekday', 'floor', 'text', 'site'))
+
+FLOORS = ('first', 'third', 'combined')
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+word = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return word.findall(text.lower())
+
+
+def menu_dishes(date, menu, site=''):
+    """Get the dishes of a Menu served on date, one for each line"""
+    for floor in FLOORS:
+        text = getattr(menu, floor)
+        if not text:
+            continue
+        for line in text.splitlines():
+            line = line.strip(' \t-*:')
+            if tokenize(line):
+                yield Dish(date, date.weekday(), floor, line, site)
+
+
+class DishIndex(object):
+    """A SQLite backed inverted index of dishes, from words to dishes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS dishes ('
+            ' id INTEGER PRIMARY KEY,'
+            ' date TEXT NOT NULL,'
+            ' weekday INTEGER NOT NULL,'
+            ' floor TEXT NOT NULL,'
+            ' text TEXT NOT NULL,'
+            ' site TEXT NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS dishes_date ON dishes (date, site)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS postings ('
+            ' token TEXT NOT NULL,'
+            ' dish INTEGER NOT NULL,'
+            ' PRIMARY KEY (token, dish)) WITHOUT ROWID'
+        )
+        self.db.commit()
+
+    def add_menu(self, date, menu, site=''):
+        """Add the dishes of a Menu, replacing any from the same date and site"""
+        day = date.isoformat()
+        old = [
+            row[0] for row in
+            self.db.execute('SELECT id FROM dishes WHERE date = ? AND site = ?', (day, site))
+        ]
+        self.db.executemany('DELETE FROM postings WHERE dish = ?', [(i,) for i in old])
+        self.db.execute('DELETE FROM dishes WHERE date = ? AND site = ?', (day, site))
+        for dish in menu_dishes(date, menu, site):
+            cursor = self.db.execute(
+                'INSERT INTO dishes (date, weekday, floor, text, site) VALUES (?, ?, ?, ?, ?)',
+                (day, dish.weekday, dish.floor, dish.text, site),
+            )
+            self.db.executemany(
+                'INSERT OR IGNORE INTO postings (token, dish) VALUES (?, ?)',
+                [(token, cursor.lastrowid) for token in set(tokenize(dish.text))],
+            )
+
+    def search(self, query, floor=None, site=None, limit=None):
+        """Get the dishes with all the words of query, newest first
+
+        Words match as prefixes, so 'taco' also finds 'tacos'. Combined
+        menus are served on every floor, so they match any floor.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        matching = ' INTERSECT '.join(
+            ['SELECT dish FROM postings WHERE token >= ? AND token < ?'] * len(tokens)
+        )
+        params = []
+        for token in tokens:
+            params.extend((token, token + '\uffff'))
+        sql = 'SELECT date, weekday, floor, text, site FROM dishes WHERE id IN (%s)' % matching
+        if floor is not None:
+            sql += ' AND floor IN (?, ?)'
+            params.extend((floor, 'combined'))
+        if site is not None:
+            sql += ' AND site = ?'
+            params.append(site)
+        sql += ' ORDER BY date DESC, id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [
+            Dish(datetime.datetime.strptime(date, '%Y-%m-%d').date(), weekday, floor, text, site)
+            for date, weekday, floor, text, site in self.db.execute(sql, params)
+        ]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM dishes').fetchone()[0]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def open_dish_index(path):
+    """Open the dish index at path, or return None if it can not be opened"""
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    try:
+        return DishIndex(path)
+    except sqlite3.Error:
+        logger.exception('Could not open dish index at %s, continuing without', path)
+        return None
+
+
+def format_dish(dish):
+    return '%s %s %-12s %-8s %s' % (
+        dish.date.isoformat(), WEEKDAYS[dish.weekday], dish.site, dish.floor, dish.text
+    )
+
+
+def record_menu(date, menu, site=''):
+    """Add the dishes of the menu for date at site to the configured index"""
+    if not any(menu):
+        return
+    index = open_dish_index(DISHES_PATH)
+    if index is None:
+        return
+    try:
+        index.add_menu(date, menu, site)
+    except sqlite3.Error:
+        logger.exception('Could not add the menu for %s to the dish index', date)
+    finally:
+        index.close()
+
+
+def run_search(arguments):
+    """Print the dishes matching the search, or how often they were served"""
+    index = open_dish_index(DISHES_PATH)
+    if index is None:
+        raise ValueError('No dish index, set path in the [Dishes] section')
+    try:
+        query = ' '.join(arguments.query)
+        limit = None if arguments.count else arguments.limit
+        dishes = index.search(query, floor=arguments.floor, site=arguments.site, limit=limit)
+    finally:
+        index.close()
+    if arguments.count:
+        days = sorted(set(dish.date for dish in dishes))
+        print('%r was served on %d days' % (query, len(days)), end='')
+        if days:
+            print(', first on %s and last on %s' % (days[0], days[-1]), end='')
+        print()
+        return
+    for dish in dishes:
+        print(format_dish(dish))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""HTTP fetching with a pooled session, timeouts and a response cache.
+
+Responses are not cached as bodies, but as the value parsed from them, so
+that a fresh cache entry or a 304 Not Modified skips parsing altogether.
+Values are keyed by URL and by the parser, so that a value is only used
+by the parser that made it. Entries are revalidated with ETag /
+Last-Modified once older than the TTL.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from .metrics import METRICS
+
+
+logger = logging.getLogger('lunchbot')
+
+
+class ResponseCache(object):
+    """A SQLite backed cache of values parsed from responses, keyed by URL
+    and parser"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # Values keyed by URL alone, from before parsers were told apart:
+        self.db.execute('DROP TABLE IF EXISTS responses')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS parsed_responses ('
+            ' url TEXT NOT NULL,'
+            ' parser TEXT NOT NULL,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' fetched REAL NOT NULL,'
+            ' value TEXT NOT NULL,'
+            ' PRIMARY KEY (url, parser))'
+        )
+        self.db.commit()
+
+    def get(self, url, parser):
+        """Get (etag, last_modified, fetched, value) for url, or None"""
+        row = self.db.execute(
+            'SELECT etag, last_modified, fetched, value FROM parsed_responses WHERE url = ? AND parser = ?',
+            (url, parser),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[:3] + (json.loads(row[3]),)
+
+    def put(self, url, parser, etag, last_modified, value):
+        self.db.execute(
+            'INSERT OR REPLACE INTO parsed_responses (url, parser, etag, last_modified, fetched, value)'
+            ' VALUES (?, ?, ?, ?, ?, ?)',
+            (url, parser, etag, last_modified, time.time(), json.dumps(value)),
+        )
+        self.db.commit()
+
+    def touch(self, url, parser):
+        """Mark the entry for url and parser as just revalidated"""
+        self.db.execute(
+            'UPDATE parsed_responses SET fetched = ? WHERE url = ? AND parser = ?', (time.time(), url, parser)
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def open_response_cache(path):
+    """Open the response cache at path, or return None if it can not be opened"""
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    try:
+        return ResponseCache(path)
+    except sqlite3.Error:
+        logger.exception('Could not open response cache at %s, continuing without', path)
+        return None
+
+
+def make_session(pool_size=4):
+    """Make a requests session with a keep-alive connection pool"""
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def saved_page_session(path):
+    """Make a requests session that answers every request with the file at path"""
+    import requests
+
+    class SavedPageAdapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response.url = request.url
+            response.request = request
+            response.encoding = 'utf-8'
+            response.raw = io.open(path, 'rb')
+            return response
+
+        def close(self):
+            pass
+
+    session = requests.Session()
+    session.mount('https://', SavedPageAdapter())
+    session.mount('http://', SavedPageAdapter())
+    return session
+
+
+class Fetcher(object):
+    """Fetch and parse URLs through a shared session and a response cache
+
+    timeout is (connect, read) in seconds, and ttl is how many seconds a
+    cached value is used before it is revalidated.
+    """
+
+    def __init__(self, session=None, cache=None, timeout=(5, 20), ttl=300):
+        # A session that is passed in may be shared, and is not closed:
+        self.own_session = session is None
+        self.session = session if session is not None else make_session()
+        self.cache = cache
+        self.timeout = timeout
+        self.ttl = ttl
+
+    def get(self, url, parse, parser):
+        """Get the value of parse(response) for url, using the cache if possible
+
+        parser names parse, with its version and anything else that changes
+        its value, as only values cached under the same name are used. The
+        response is streamed, so parse may stop reading it early.
+        """
+        entry = self.cache.get(url, parser) if self.cache is not None else None
+        headers = {}
+        if entry is not None:
+            etag, last_modified, fetched, value = entry
+            if time.time() - fetched < self.ttl:
+                logger.debug('Using cached %s', url)
+                METRICS.inc('lunchbot_fetches_total', result='cached')
+                return value
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        r = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        try:
+            if r.status_code == 304 and entry is not None:
+                logger.debug('Not modified: %s', url)
+                METRICS.inc('lunchbot_fetches_total', result='not modified')
+                self.cache.touch(url, parser)
+                return entry[3]
+            r.raise_for_status()
+            value = parse(r)
+        finally:
+            # Bytes read off the wire, which may be less than the whole body:
+            METRICS.inc('lunchbot_fetched_bytes_total', r.raw.tell() if hasattr(r.raw, 'tell') else 0)
+            r.close()
+        METRICS.inc('lunchbot_fetches_total', result='fetched')
+        if self.cache is not None:
+            self.cache.put(url, parser, r.headers.get('ETag'), r.headers.get('Last-Modified'), value)
+        return value
+
+    def fork(self):
+        """Make a fetcher with the same session and settings, and its own
+        connection to the cache, to use in another thread"""
+        cache = open_response_cache(self.cache.path) if self.cache is not None else None
+        return Fetcher(self.session, cache, self.timeout, self.ttl)
+
+    def close(self):
+        if self.own_session:
+            self.session.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Keep a local archive of the posts of a facebook page up to date.
+
+The archive is a PostArchive of the posts, oldest first, named by their
+id, that backfill and the archive source read. The newest post in it is
+the watermark: new posts are paged through newest first with only the
+fields that are used, and paging stops at the first post that is not
+newer than it. A daily sync then costs a page or two of the Graph API,
+not the history, and appends the new posts to the archive.
+
+Each post is classified once, as it is archived, by the classifier, and
+its kind kept in the metadata of its entry. An archive of JSON lines,
+as written before, is converted in place by the first ingest, and one at
+the path with .jsonl added, as the default path was, is imported.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import datetime
+import logging
+import os
+
+from . import classifier
+from .apiwrappers import filter_messages
+from .archive import PostArchive, append_archive, import_posts, is_archive
+
+
+logger = logging.getLogger('lunchbot')
+
+# The most posts the Graph API returns in a page:
+PAGE_SIZE = 100
+
+FIELDS = 'message,created_time'
+
+# The name of each kind of menu post in the archive, as in the names of
+# the historical posts. Single floor posts are named by their floor:
+KINDS = {
+    classifier.WEEKLY_COMBINED: 'combined',
+    classifier.DAILY_COMBINED: 'dailycomb',
+    classifier.BY_DAY_FIRST: 'byday',
+}
+
+
+def classify(message):
+    """Get the kind of menu in a message, or None if it is not a menu"""
+    classified = classifier.classify(message)
+    if classified.kind == classifier.WEEKLY_SINGLE_FLOOR:
+        return classified.floors[0]
+    return KINDS.get(classified.kind)
+
+
+def _position(post):
+    from .main import TIME_FORMAT
+    return datetime.datetime.strptime(post['created_time'], TIME_FORMAT), post.get('id', '')
+
+
+def read_watermark(path):
+    """Get (created time, id) of the last post in the archive, or None"""
+    if not is_archive(path):
+        return None
+    with PostArchive(path) as archive:
+        if not archive.entries:
+            return None
+        entry = archive.entries[-1]
+    return _position(dict(created_time=entry.created_time, id=entry.name))
+
+
+def new_posts(graph, page, watermark=None):
+    """Get the posts of page newer than watermark, newest first"""
+    found = []
+    for result in graph.get('%s/posts' % page, page=True, fields=FIELDS, limit=PAGE_SIZE):
+        reached = False
+        for post in result.get('data', []):
+            if watermark is not None and _position(post) <= watermark:
+                # Finish the page, as pinned posts may come out of order:
+                reached = True
+                continue
+            found.append(post)
+        logger.debug('Paged through %d new posts of %s', len(found), page)
+        if reached:
+            break
+    return found
+
+
+def ingest(graph, page, path):
+    """Append the posts of page newer than those in the archive at path,
+    and get how many were added"""
+    if os.path.exists(path) and not is_archive(path):
+        logger.info('Converting the JSON lines in %s to an archive', path)
+        import_posts(path, path)
+    elif not os.path.exists(path) and os.path.isfile(path + '.jsonl'):
+        logger.info('Importing the JSON lines in %s.jsonl to an archive at %s', path, path)
+        import_posts(path + '.jsonl', path)
+    watermark = read_watermark(path)
+    posts = sorted(filter_messages(new_posts(graph, page, watermark)), key=_position)
+    records = []
+    for post in posts:
+        kind = classify(post['message'])
+        records.append((
+            post.get('id') or post['created_time'], post['created_time'], post['message'],
+            dict(kind=kind) if kind is not None else None,
+        ))
+    append_archive(path, records)
+    logger.info('Archived %d new posts of %s to %s', len(posts), page, path)
+    return len(posts)
+
+
+def run_ingest(arguments):
+    from .config import FACEBOOK_ID, FACEBOOK_SECRET, INGEST_PATH, SITES
+    from .apiwrappers import authenticated_graph
+    from .main import open_fetcher
+    sites = dict((site.name, site) for site in SITES)
+    if arguments.site is not None and arguments.site not in sites:
+        raise ValueError('Unknown site %r, expected one of %s' % (arguments.site, ', '.join(sites)))
+    site = sites.get(arguments.site, SITES[0])
+    if None in (FACEBOOK_ID, FACEBOOK_SECRET):
+        raise ValueError('Missing facebook id or secret')
+    path = os.path.expanduser(arguments.archive or site.archive or INGEST_PATH)
+    fetcher = open_fetcher(cached=False)
+    try:
+        graph = authenticated_graph(FACEBOOK_ID, FACEBOOK_SECRET, fetcher)
+        count = ingest(graph, site.page, path)
+    finally:
+        fetcher.close()
+    print('Archived %d new posts of %s' % (count, site.page))
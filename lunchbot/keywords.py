@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Find keywords, and their misspellings, in a single pass over a text.
+
+The keywords and every spelling of them one typo away are put in a trie,
+and the trie is written out as a single pattern, with an alternative for
+each branch. Matching it is then one pass over the text by the regular
+expression engine: at each position, the trie is walked at most as deep
+as the longest keyword, so the cost grows linearly with the text and
+hardly at all with the number of keywords.
+
+A typo is a letter that is swapped for any other, added or left out
+inside the word, or two neighbouring letters that are swapped. As a
+misspelling is more likely to be a word of its own than a keyword is,
+misspellings are only matched as a whole word, and only where the
+keyword itself is not found.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import re
+
+
+# Stands for any letter in a spelling:
+ANY = None
+
+LETTER = r'[^\W\d_]'
+
+_END = ''
+
+
+def misspellings(word):
+    """Get the spellings of word one typo away, as tuples of letters with
+    ANY for any letter"""
+    letters = tuple(word)
+    n = len(letters)
+    spellings = set()
+    for i in range(n):
+        spellings.add(letters[:i] + (ANY,) + letters[i + 1:])
+    for i in range(1, n):
+        spellings.add(letters[:i] + (ANY,) + letters[i:])
+    for i in range(1, n - 1):
+        spellings.add(letters[:i] + letters[i + 1:])
+    for i in range(n - 1):
+        spellings.add(letters[:i] + (letters[i + 1], letters[i]) + letters[i + 2:])
+    return spellings
+
+
+def _trie(spellings):
+    root = {}
+    for spelling in spellings:
+        node = root
+        for letter in spelling:
+            node = node.setdefault(letter, {})
+        node[_END] = {}
+    return root
+
+
+def _pattern(node):
+    # Known letters before any letter, and longer spellings before shorter:
+    branches = [
+        re.escape(letter) + _pattern(node[letter])
+        for letter in sorted(letter for letter in node if letter not in (_END, ANY))
+    ]
+    if ANY in node:
+        branches.append(LETTER + _pattern(node[ANY]))
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:%s)' % '|'.join(branches)
+    if _END in node:
+        return '(?:%s)?' % body
+    return body
+
+
+def keyword_pattern(keywords):
+    """Write a pattern that matches any of keywords, or a misspelling of
+    one as a whole word. Keywords are matched as written, so compile the
+    pattern with re.IGNORECASE to match them in any case."""
+    exact = _pattern(_trie(keyword.lower() for keyword in keywords))
+    typos = _pattern(_trie(
+        spelling for keyword in keywords for spelling in misspellings(keyword.lower())
+    ))
+    return '%s|(?<!%s)%s(?!%s)' % (exact, LETTER, typos, LETTER)
+
+
+def within_one_typo(word, keyword):
+    """Tell if word is keyword, or one typo away from it"""
+    if word == keyword:
+        return True
+    if abs(len(word) - len(keyword)) > 1:
+        return False
+    # Skip the common start and end, and look at what differs:
+    start = 0
+    while start < min(len(word), len(keyword)) and word[start] == keyword[start]:
+        start += 1
+    end = 0
+    while (end < min(len(word), len(keyword)) - start
+           and word[-1 - end] == keyword[-1 - end]):
+        end += 1
+    a, b = word[start:len(word) - end], keyword[start:len(keyword) - end]
+    if len(a) <= 1 and len(b) <= 1:
+        return True
+    return len(a) == len(b) == 2 and a == b[::-1]
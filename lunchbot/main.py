@@ -4,38 +4,73 @@
 from __future__ import print_function, unicode_literals
 
 import re
+import bisect
 import collections
 import datetime
-import locale
+import functools
+import hashlib
 import logging
-from pytz import timezone
-
-from .config import config, parser, SLACK_TOKEN, FACEBOOK_SECRET, FACEBOOK_ID, SLACK_CHANNELS
-from .apiwrappers import authenticated_graph, filter_messages, scrape_posts, SlackPoster
+import time
+from functools import lru_cache
+
+from .config import (
+    config, get_parser, SLACK_TOKEN, FACEBOOK_SECRET, FACEBOOK_ID, SITES, SITE_WORKERS, PARSE_BUDGET,
+    CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_MAX_AGE,
+    FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, FETCH_CACHE_PATH, FETCH_CACHE_TTL, STATS_PATH,
+    METRICS_PATH, OUTBOX_PATH, WORKSPACES,
+)
+from .apiwrappers import filter_messages, SlackPoster
+from .cache import open_cache, MISSING
+from .fetch import Fetcher, make_session, open_response_cache, saved_page_session
+from .dishes import record_menu
+from .stats import STATS, load_stats, save_stats
+from .metrics import METRICS, write_metrics
+from .outbox import QueuedPoster
+from .sources import SOURCES, available_sources, first_usable
+from .profiling import timed
+from .classifier import (
+    classify, BY_DAY_FIRST, DAILY_COMBINED, WEEKLY_COMBINED, WEEKLY_SINGLE_FLOOR,
+)
+from . import segmenter
+from .segmenter import (
+    split_days, compile_floor_headers, floor_headers, Deadline, ParseTimeout,
+)
 
 
 logger = logging.getLogger('lunchbot')
-locale.setlocale(locale.LC_ALL, "no_NO")
 
+# Only posts this many days from the menu date are considered:
+MENU_WINDOW_DAYS = 14
+
+# Format of created_time in posts:
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+# The patterns below are written to fail in linear time: headers must start a
+# line, lines are skipped whole rather than a character at a time, a floor
+# marker must be within 80 lines of the week header, and the first section
+# of a combined menu ends before the next menu header.
+LINE_START = r'(?<![^\n])'
 floor_flags = re.IGNORECASE
-patterns_first_floor = (
-    r'(Meny|Menu) (uke|week) (?P<weeknum>\d+)(\D|\n)(.|\n)*?1.*?(etg|etasje|etage):?',
-    r'(Meny|Menu) Transit (uke|week) (?P<weeknum>\d+):?',
+first_floor_sources = (
+    LINE_START + r'(Meny|Menu) (uke|week) (?P<weeknum>\d+)\D(?:[^\n]*\n){0,80}?[^\n]*?\b1[ \t]*\.?[ \t]*(etg|etasje|etage):?',
+    LINE_START + r'(Meny|Menu) Transit (uke|week) (?P<weeknum>\d+):?',
 )
-patterns_third_floor = (
-    r'Meny (uke|week) (?P<weeknum>\d+)(\D|\n)(.|\n)*?3.*?(etg|etasje|etage):?',
-    r'(Meny|Menu) Expeditionen (uke|week) (?P<weeknum>\d+):?',
+third_floor_sources = (
+    LINE_START + r'Meny (uke|week) (?P<weeknum>\d+)\D(?:[^\n]*\n){0,80}?[^\n]*?\b3[ \t]*\.?[ \t]*(etg|etasje|etage):?',
+    LINE_START + r'(Meny|Menu) Expeditionen (uke|week) (?P<weeknum>\d+):?',
 )
 
-patterns_first_floor = [re.compile(p, flags=floor_flags) for p in patterns_first_floor]
-patterns_third_floor = [re.compile(p, flags=floor_flags) for p in patterns_third_floor]
-
-COMBINED_HEADER = r'((Meny(er)?|Menus?).*(uke|week)|Week|Uke).*(?P<weeknum>\d+)[^\n]*'
-FIRST_FLOOR_HEADER = r'[^\n]*TRANSIT[^\n]*'
-THIRD_FLOOR_HEADER = r'[^\n]*(EXPEDITI?ON(EN)?|EXPEDISJON(EN)?|EKSPEDISJON(EN)?)[^\n]*'
+COMBINED_HEADER = (
+    LINE_START + r'((Meny(er)?|Menus?)[^\n]{0,40}?(uke|week)|\bWeek|\bUke)[^\d\n]*(?P<weeknum>\d+)(?!\d)[^\n]*'
+)
+FIRST_FLOOR_HEADER = r'(?=[^\n]*TRANSIT)[^\n]*(?![^\n])'
+THIRD_FLOOR_HEADER = r'(?=[^\n]*(EXPEDITI?ON|EXPEDISJON|EKSPEDISJON))[^\n]*(?![^\n])'
+BLANK_LINES = r'\n(?:[^\S\n]*\n)*'
+# A section that stops before any line starting a new menu header:
+SECTION = r'(?:[^\n]|\n(?!(Meny(er)?|Menus?|Week|Uke)\b))*?'
 
 COMBINED_DAILY_HEADER = (
-    r'(Meny(er)?|Menus?) (?P<weekday>\w+)?\s?((?P<day>\d+)\.?)\s?(?P<month>\w+)[^\n]*'
+    LINE_START + r'(Meny(er)?|Menus?) ((?P<weekday>[^\W\d_]+) ?)?(?P<day>\d+)(?!\d)\.? ?(?P<month>[^\W\d_]+)[^\n]*'
 )
 
 HEADERS = dict(
@@ -43,131 +78,382 @@ HEADERS = dict(
     COMBINED_DAILY_HEADER=COMBINED_DAILY_HEADER,
     FIRST_FLOOR_HEADER=FIRST_FLOOR_HEADER,
     THIRD_FLOOR_HEADER=THIRD_FLOOR_HEADER,
+    BLANK_LINES=BLANK_LINES,
+    SECTION=SECTION,
 )
 
-patterns_combined = (
-    r'{COMBINED_HEADER}\s+'
-    r'{FIRST_FLOOR_HEADER}\s*(?P<first>.*?)\s+'
-    r'{THIRD_FLOOR_HEADER}\s*(?P<third>.*)',
-    r'{COMBINED_HEADER}\s+'
-    r'{THIRD_FLOOR_HEADER}\s*(?P<third>.*)\s+'
-    r'{FIRST_FLOOR_HEADER}\s*(?P<first>.*?)',
+combined_sources = (
+    r'{COMBINED_HEADER}{BLANK_LINES}'
+    r'{FIRST_FLOOR_HEADER}(?P<first>{SECTION})\n'
+    r'{THIRD_FLOOR_HEADER}(?P<third>.*)',
+    r'{COMBINED_HEADER}{BLANK_LINES}'
+    r'{THIRD_FLOOR_HEADER}(?P<third>{SECTION})\n'
+    r'{FIRST_FLOOR_HEADER}(?P<first>.*)',
 )
 combined_flags = re.IGNORECASE | re.DOTALL
-patterns_combined = [
-    re.compile(p.format(**HEADERS), flags=combined_flags) for p in patterns_combined
-]
+combined_sources = tuple(p.format(**HEADERS) for p in combined_sources)
 
-weekly_pattern = re.compile(COMBINED_HEADER, flags=combined_flags)
+daily_combined_sources = (
+    r'{COMBINED_DAILY_HEADER}{BLANK_LINES}'
+    r'{FIRST_FLOOR_HEADER}(?P<first>{SECTION})\n'
+    r'{THIRD_FLOOR_HEADER}(?P<third>.*)',
 
-patterns_daily_combined = (
-    r'{COMBINED_DAILY_HEADER}\s+'
-    r'{FIRST_FLOOR_HEADER}\s*(?P<first>.*?)\s+'
-    r'{THIRD_FLOOR_HEADER}\s*(?P<third>.*)',
+    r'{COMBINED_DAILY_HEADER}{BLANK_LINES}'
+    r'{THIRD_FLOOR_HEADER}(?P<third>{SECTION})\n'
+    r'{FIRST_FLOOR_HEADER}(?P<first>.*)',
+)
+daily_combined_sources = tuple(p.format(**HEADERS) for p in daily_combined_sources)
 
-    r'{COMBINED_DAILY_HEADER}\s+'
-    r'{THIRD_FLOOR_HEADER}\s*(?P<third>.*)\s+'
-    r'{FIRST_FLOOR_HEADER}\s*(?P<first>.*?)',
+PATTERN_SOURCES = dict(
+    patterns_first_floor=(first_floor_sources, floor_flags),
+    patterns_third_floor=(third_floor_sources, floor_flags),
+    patterns_combined=(combined_sources, combined_flags),
+    patterns_daily_combined=(daily_combined_sources, combined_flags),
 )
-patterns_daily_combined = [
-    re.compile(p.format(**HEADERS), flags=combined_flags)
-    for p in patterns_daily_combined
-]
 
-patterns_daily = (
-    r'{FIRST_FLOOR_HEADER}\s*(?P<first>.*?)\s+'
-    r'{THIRD_FLOOR_HEADER}\s*(?P<third>.*)',
 
-    r'{THIRD_FLOOR_HEADER}\s*(?P<third>.*)\s+'
-    r'{FIRST_FLOOR_HEADER}\s*(?P<first>.*?)',
-)
-patterns_daily = [
-    re.compile(p.format(**HEADERS), flags=combined_flags)
-    for p in patterns_daily
-]
-
-pattern_days = [
-    r'(MANDAG|MONDAY):?\s*(.*?)[\s\-]*\n\s*([^\n]*(TIRSDAG|TUESDAY|ONSDAG|WEDNESDAY|WENDSDAY|WEDNESAY|TORSDAG|THURSDAY|FREDAG|FRIDAY))|$',
-    r'(TIRSDAG|TUESDAY):?\s*(.*?)[\s\-]*\n\s*([^\n]*(ONSDAG|WEDNESDAY|WENDSDAY"WEDNESAY|TORSDAG|THURSDAY|FREDAG|FRIDAY))|$',
-    r'(ONSDAG|WEDNESDAY|WENDSDAY|WEDNESAY):?\s*(.*?)[\s\-]*\n\s*([^\n]*(TORSDAG|THURSDAY|FREDAG|FRIDAY))|$',
-    r'(TORSDAG|THURSDAY):?\s*(.*?)[\s\-]*\n\s*[^\n]*((FREDAG|FRIDAY))|$',
-    r'(FREDAG|FRIDAY):?\s*(.*?)[\s\-]*$',
-]
-days_flags = re.IGNORECASE | re.DOTALL
-pattern_days = [re.compile(p, flags=combined_flags) for p in pattern_days]
+# Names of the compiled patterns, for their statistics:
+PATTERN_NAMES = {}
+
+
+@lru_cache(None)
+def get_patterns(name):
+    """Compile a group of patterns from PATTERN_SOURCES on first use"""
+    sources, flags = PATTERN_SOURCES[name]
+    patterns = []
+    for i, source in enumerate(sources):
+        pattern = timed(re.compile(source, flags=flags), '%s[%d]' % (name, i))
+        PATTERN_NAMES[pattern] = '%s[%d]' % (name, i)
+        patterns.append(pattern)
+    return patterns
+
+
+def pattern_name(pattern):
+    return PATTERN_NAMES.get(pattern) or pattern.pattern[:40]
+
+
+def record_try(name, hit, seconds, when=None):
+    """Count a try of a pattern variant, in the statistics and the metrics"""
+    STATS.record(name, hit, seconds, when)
+    METRICS.inc('lunchbot_patterns_tried_total', variant=name, result='hit' if hit else 'miss')
+
+
+def __getattr__(name):
+    # Makes e.g. `patterns_combined` available as a (lazily compiled) attribute
+    if name in PATTERN_SOURCES:
+        return get_patterns(name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
 
 Menu = collections.namedtuple('Menu', ('first', 'third', 'combined'), defaults=(None, None, None))
 
+# A post parsed on its own, before matching it against any date:
+ParsedPost = collections.namedtuple(
+    'ParsedPost', ('kind', 'weeknum', 'day', 'month', 'by_floor', 'menus')
+)
 
-def run(post_menu=None):
-    if None in (SLACK_TOKEN, FACEBOOK_SECRET, FACEBOOK_ID):
-        raise ValueError("Missing configuration value")
+# Bump when changing how posts are parsed without changing any pattern:
+PARSER_VERSION = 2
 
+
+def run(post_menu=None, saved_page=None, cached=True):
+    """Fetch the menus of all sites, and post each to its workspaces
+
+    Posts are read from the file saved_page instead of facebook if given,
+    and the response and parse caches are used if cached.
+    """
+    from pytz import timezone
+    if post_menu is None:
+        check_config()
+
+    targets = {}
     if post_menu is None:
         # Fail early for slack issues, as that is our main output channel:
-        logger.info('Initializing slack client with channels %s...', SLACK_CHANNELS)
-        sp = SlackPoster(SLACK_TOKEN, SLACK_CHANNELS)
-        post_menu = sp.post
+        clients = slack_clients()
+    for site in SITES:
+        if post_menu is None:
+            targets[site.name] = site_targets(site, clients)
+            logger.info('Posting the menu of %s to %s', site.name, ', '.join(t.name for t in targets[site.name]))
+        else:
+            targets[site.name] = [Target('local', post_menu, None)]
+
+    now = datetime.datetime.now(timezone('Europe/Oslo'))
+    load_stats(STATS_PATH)
+    sources = None
+    if saved_page is not None:
+        # The saved page stands in for the scraped one, not for the other sources:
+        session, sources = saved_page_session(saved_page), ['scraper']
+    else:
+        session = make_session(SITE_WORKERS)
+    start = time.perf_counter()
+    success = False
+    try:
+        for_each_site(SITES, lambda site: run_site(site, now, session, targets[site.name], cached, sources))
+        success = True
+    finally:
+        session.close()
+        save_stats(STATS_PATH)
+        record_run(start, success)
 
-    menu = Menu()
 
-    try:
-        # logger.info('Initializing Facebook graph API...')
-        # graph = authenticated_graph(FACEBOOK_ID, FACEBOOK_SECRET)
+# Where to post the menu of a site: the workspace, a function that posts a
+# message, and the floor to post the menu of, None for both:
+Target = collections.namedtuple('Target', ('name', 'post_menu', 'floor'))
 
-        logger.info('Getting facebook posts...')
-        # posts = graph.get('technopolisitfornebu/published_posts')['data']
-        posts = scrape_posts("technopolisitfornebu")
 
-        menu = get_menus(posts, datetime.datetime.now(timezone('Europe/Oslo')))
-    finally:
-        if menu.first:
-            post_menu('*First floor menu:*\n' + menu.first)
-        if menu.third:
-            post_menu('*Third floor menu:*\n' + menu.third)
-        if menu.combined and not (menu.first or menu.third):
-            post_menu("*Today's menu:*\n" + menu.combined)
-        else:
-            # not combined, post a single sad message
-            if not menu.first and not menu.third:
-                post_menu(
-                    '_Could not find a menu for today_ :disappointed:'
-                )
-            if menu.first and not menu.third:
-                post_menu(
-                    '_Could not find a menu for the third floor today_ :disappointed:'
-                )
-            elif menu.third and not menu.first:
-                post_menu(
-                    '_Could not find a menu for the first floor today_ :disappointed:'
-                )
-
-
-def filter_msg_distance(posts, ref, days):
-    """Filter any message by distance from a reference"""
-    for post in posts:
-        msg_dt = datetime.datetime.strptime(post['created_time'], '%Y-%m-%dT%H:%M:%S%z')
-        if abs(msg_dt - ref).days <= days:
-            logger.info("checking post from: {}".format(post['created_time']))
-            logger.debug(' '.join(post['message'].lstrip().splitlines()[:1]))
-            yield post
-        else:
-            logger.debug("ignoring post from: {}".format(post['created_time']))
-            logger.debug(' '.join(post['message'].lstrip().splitlines()[:1]))
+def slack_client(token):
+    """Make a Slack client for a workspace, to post to any of its channels"""
+    # Rate limits are waited out by the outbox, if any, not by the client:
+    return SlackPoster(token, [], max_retries=0 if OUTBOX_PATH else 3)
+
+
+def slack_clients():
+    """Make a Slack client for each workspace, by name"""
+    return dict((workspace.name, slack_client(workspace.token)) for workspace in WORKSPACES)
+
+
+def site_targets(site, clients, channels=None):
+    """Get the Targets of the workspaces that post the menu of site, with
+    the clients of slack_clients. Only channels in channels if given."""
+    targets = []
+    for workspace in WORKSPACES:
+        if workspace.sites and site.name not in workspace.sites:
+            continue
+        posted = [
+            c for c in workspace.channels or site.channels if channels is None or c in channels
+        ]
+        if not posted:
+            continue
+        # The default workspace keeps the outbox keys from before there were several:
+        name = site.name if workspace.name == 'default' else '%s/%s' % (workspace.name, site.name)
+        targets.append(Target(workspace.name, slack_poster(posted, name, clients[workspace.name]), workspace.floor))
+    return targets
+
+
+def slack_poster(channels, name, client=None):
+    """Get a function that posts a message to channels, through the outbox
+    unless it is disabled. name tells the messages of each site apart, and
+    client is the SlackPoster of the workspace, one for SLACK_TOKEN if None."""
+    if client is None:
+        client = slack_client(SLACK_TOKEN)
+    if not OUTBOX_PATH:
+        return functools.partial(client.post, channels=channels)
+    return QueuedPoster(
+        client.post_to, channels, OUTBOX_PATH, message_kind, name + ':', today=oslo_today, workers=client.max_workers,
+    ).post
+
+
+def oslo_today():
+    from pytz import timezone
+    return datetime.datetime.now(timezone('Europe/Oslo')).date()
 
 
-def localized_month(monthstr):
+def record_run(start, success):
+    """Record the duration and outcome of a run, and write out the metrics"""
+    METRICS.observe('lunchbot_run_seconds', time.perf_counter() - start)
+    METRICS.set('lunchbot_last_run_timestamp_seconds', time.time())
+    METRICS.set('lunchbot_last_run_success', 1 if success else 0)
+    write_metrics(METRICS_PATH)
+
+
+def run_site(site, date, session, targets, cached=True, sources=None):
+    """Fetch the menu of one site, and post it to targets"""
+    menu = Menu()
     try:
-        return datetime.datetime.strptime(monthstr, "%B").month
-    except ValueError:
-        return None
+        menu = fetch_site_menu(site, date, session, cached, sources)
+        record_menu(date.date(), menu, site.name)
+    finally:
+        with METRICS.timer('post', site=site.name):
+            deliver(menu, targets)
+    return menu
+
+
+def deliver(menu, targets, workers=8):
+    """Post a menu to all targets at once, raising the first failure once
+    every target has been tried"""
+    if len(targets) == 1:
+        post_menus(menu, targets[0].post_menu, targets[0].floor)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as pool:
+        futures = [
+            (target, pool.submit(post_menus, menu, target.post_menu, target.floor)) for target in targets
+        ]
+    error = None
+    for target, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception('Failed to post the menu to %s', target.name)
+            error = error or e
+    if error is not None:
+        raise error
+
+
+def for_each_site(sites, func, workers=SITE_WORKERS):
+    """Call func(site) for each site, in a bounded pool of threads
+
+    Returns the results by site name. A failing site does not stop the
+    others, and the first failure is raised once all sites are done.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sites)))) as pool:
+        futures = [(site, pool.submit(func, site)) for site in sites]
+    results = collections.OrderedDict()
+    error = None
+    for site, future in futures:
+        try:
+            results[site.name] = future.result()
+        except Exception as e:
+            logger.exception('Failed to get the menu of %s', site.name)
+            error = error or e
+    if error is not None:
+        raise error
+    return results
+
+
+def check_config():
+    if None in [w.token for w in WORKSPACES] + [FACEBOOK_SECRET, FACEBOOK_ID]:
+        raise ValueError("Missing configuration value")
+
+
+def open_fetcher(session=None, cached=True):
+    """Make a fetcher as configured in the [Fetch] section"""
+    return Fetcher(
+        session=session,
+        cache=open_response_cache(FETCH_CACHE_PATH) if cached else None,
+        timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT),
+        ttl=FETCH_CACHE_TTL,
+    )
 
 
-def get_menus(posts, date):
-    """Get the menu for the given date."""
+def fetch_site_menu(site, date, session=None, cached=True, sources=None):
+    """Fetch the menu of a site, with caches of its own, as SQLite
+    connections can not be shared between threads"""
+    return _with_caches(fetch_menu, site, date, session, cached, sources)
+
+
+def fetch_site_index(site, date, session=None, days=MENU_WINDOW_DAYS, sources=None):
+    """Fetch the posts of a site into a PostIndex, with caches of its own"""
+    return _with_caches(fetch_index, site, date, session, True, days, sources)
+
+
+def _with_caches(func, site, date, session, cached, *args):
+    cache = open_parse_cache() if cached else None
+    fetcher = open_fetcher(session, cached)
+    try:
+        return func(date, fetcher, cache, site, *args)
+    finally:
+        fetcher.close()
+        if cache is not None:
+            cache.close()
+
+
+def fetch_index(date, fetcher=None, cache=None, site=None, days=MENU_WINDOW_DAYS, sources=None):
+    """Fetch the latest posts of a site, back to days before date, and index them
+
+    The posts are from the first of the named sources, those in [Sources]
+    by default, to give a menu for date.
+    """
+    if site is None:
+        site = SITES[0]
+    if fetcher is None:
+        fetcher = Fetcher()
+    # Posts are newest first, so stop reading them once past the window:
+    oldest = date - datetime.timedelta(days=days + 1)
+    headers = compile_floor_headers(site.floor_headers)
+    names = available_sources(site, sources)
+
+    def fetch(name, fetcher=fetcher):
+        logger.info('Getting facebook posts from %s...', name)
+        with METRICS.timer('fetch', site=site.name):
+            return SOURCES[name](site, oldest, fetcher)
+
+    def fetch_forked(name):
+        # In a thread of its own, so with its own connection to the response cache:
+        forked = fetcher.fork()
+        try:
+            return fetch(name, forked)
+        finally:
+            forked.close()
+
+    def check(name, posts):
+        with METRICS.timer('parse', site=site.name):
+            index = PostIndex(filter_messages(posts), cache, headers=headers)
+        METRICS.inc('lunchbot_posts_scanned_total', len(index), site=site.name)
+        METRICS.inc(
+            'lunchbot_posts_matched_total',
+            sum(1 for entry in index.entries if entry.parsed is not None),
+            site=site.name,
+        )
+        return index, any(get_menus(None, date, index=index))
+
+    if len(names) == 1:
+        return check(names[0], fetch(names[0]))[0]
+    return first_usable(names, fetch_forked, check)
+
+
+def fetch_menu(date, fetcher=None, cache=None, site=None, sources=None):
+    """Fetch the latest posts of a site, and get the menu for the given date from them"""
+    return get_menus(None, date, index=fetch_index(date, fetcher, cache, site, MENU_WINDOW_DAYS, sources))
+
+
+NO_MENU = '_Could not find a menu for today_ :disappointed:'
+
+
+def message_kind(message):
+    """Tell a menu from the apology for not finding one"""
+    return 'apology' if message == NO_MENU else 'menu'
+
+
+def render_menu(menu, floor=None):
+    """Get the parts of the message for a menu, with apologies for the parts that are missing
+
+    Only the menu of floor is rendered if given, unless the menu is not
+    split by floor.
+    """
+    if floor is not None and (menu.first or menu.third):
+        text = getattr(menu, floor)
+        return ['*%s floor menu:*\n%s' % (floor.capitalize(), text) if text else NO_MENU]
+    parts = []
+    if menu.first:
+        parts.append('*First floor menu:*\n' + menu.first)
+    if menu.third:
+        parts.append('*Third floor menu:*\n' + menu.third)
+    if menu.combined and not (menu.first or menu.third):
+        parts.append("*Today's menu:*\n" + menu.combined)
+    else:
+        # not combined, add a single sad message
+        if not menu.first and not menu.third:
+            parts.append(NO_MENU)
+        if menu.first and not menu.third:
+            parts.append(
+                '_Could not find a menu for the third floor today_ :disappointed:'
+            )
+        elif menu.third and not menu.first:
+            parts.append(
+                '_Could not find a menu for the first floor today_ :disappointed:'
+            )
+    return parts
+
+
+def post_menus(menu, post_menu, floor=None):
+    """Post a menu as a single message"""
+    post_menu('\n\n'.join(render_menu(menu, floor)))
+
+
+def get_menus(posts, date, cache=None, index=None, headers=floor_headers):
+    """Get the menu for the given date.
+
+    Pass an index to look up several dates in the same posts.
+    """
+    if index is None:
+        index = PostIndex(filter_messages(posts), cache, headers=headers)
+    window = index.window(date, MENU_WINDOW_DAYS)
+    logger.info('Checking %d posts around %s', window[1] - window[0], date.date())
+
     # First, try daily menu:
-    posts = list(filter_msg_distance(filter_messages(posts), date, 14))
-    menu = get_menus_for_day(posts, date)
+    menu = get_menus_for_day(None, date, index=index, window=window)
     if menu:
         return menu
 
@@ -175,7 +461,7 @@ def get_menus(posts, date):
     week_number = date.isocalendar()[1]
 
     logger.info("No daily menu, checking for week {}".format(week_number))
-    menus = get_menus_for_week(posts, week_number)
+    menus = get_menus_for_week(None, week_number, index=index, window=window)
     weekday = date.weekday()
     if weekday < 5:
         return menus[weekday]
@@ -183,72 +469,248 @@ def get_menus(posts, date):
         return Menu()
 
 
-def get_menus_for_day(posts, date):
-    """Get the menu for the given date matching daily menu."""
-    # First, try daily menu:
-    day = date.day
-    month = date.month
-
-    for post in posts:
-        message = post['message']
-        for pattern in patterns_daily_combined:
-            match = pattern.search(message)
-            if (
-                match is not None
-                and localized_month(match.group('month')) == month
-                and int(match.group('day')) == day
-            ):
-                logger.info('Found post that matches a combined menu for this day')
-                logger.debug(message)
-                first, third = match.group('first', 'third')
-                return Menu(trim_multiline(first), trim_multiline(third))
-
-    return None
-
-
-def get_menus_for_week(posts, week_number):
-    """Get the menu for the given week number."""
-    menu_first_floor = None
-    menu_third_floor = None
-    # first, find the post with a likely weekly menu
-    for post in posts:
-        message = post['message']
-        match = weekly_pattern.search(message)
-        if match:
-            logger.warning("Found likely weekly menu from %s", post['created_time'])
-            break
+def classify_post(post, budget=None, headers=floor_headers):
+    """Classify a post, or return None if it can not be parsed within budget"""
+    if budget is None:
+        budget = PARSE_BUDGET
+    try:
+        return classify(post['message'], budget, headers)
+    except ParseTimeout:
+        logger.warning(
+            'Skipping post from %s, parsing took longer than %ss',
+            post.get('created_time'), budget,
+        )
+        return None
+
+
+def parser_version():
+    """Identify the parser, so that cached results from other versions are
+    not used. Changes whenever a pattern definition changes."""
+    h = hashlib.sha1(str(PARSER_VERSION).encode('utf8'))
+    definitions = [
+        (source, flags)
+        for name, (sources, flags) in sorted(PATTERN_SOURCES.items())
+        for source in sources
+    ]
+    definitions.extend(
+        (pattern.pattern, pattern.flags)
+        for pattern in [segmenter.week_header, segmenter.daily_header, segmenter.day_keywords()]
+        + [p for _, p in segmenter.floor_headers]
+    )
+    for source, flags in definitions:
+        h.update(('%s:%d\n' % (source, flags)).encode('utf8'))
+    return h.hexdigest()
+
+
+def open_parse_cache():
+    """Open the parse cache configured in the [Cache] section"""
+    return open_cache(
+        CACHE_PATH, parser_version(), max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE
+    )
+
+
+def parse_post(post, cache=None, headers=floor_headers):
+    """Parse a post into a ParsedPost, or None if it is not a menu.
+
+    Floor header lines are found with headers, from compile_floor_headers.
+    If a cache is given, it is checked before parsing, and updated after.
+    """
+    message = post['message']
+    if headers is not floor_headers:
+        # Parsed with other floor headers, so cache it apart:
+        key = ''.join(pattern.pattern + '\n' for _, pattern in headers) + message
     else:
-        logger.warning('No weekly menu found!')
+        key = message
+    if cache is not None:
+        value = cache.get(key)
+        if value is not MISSING:
+            if value is None:
+                return None
+            value['menus'] = [Menu(*menu) for menu in value['menus']]
+            return ParsedPost(**value)
+
+    METRICS.inc('lunchbot_posts_parsed_total')
+    start = time.perf_counter()
+    classified = classify_post(post, headers=headers)
+    if classified is None:
+        # Not cached, the budget might be met on a less busy run
+        return None
+    extract = EXTRACTORS.get(classified.kind)
+    parsed = extract(classified.segments) if extract is not None else None
+    seconds = time.perf_counter() - start
+    layout = _layout(parsed)
+    for name in LAYOUTS:
+        record_try(
+            'segment:' + name, name == layout, seconds if name == layout else 0.0,
+            post.get('created_time', '')[:10] or None,
+        )
+    if cache is not None:
+        cache.put(key, parsed._asdict() if parsed is not None else None)
+    return parsed
+
+
+# The variants of posts that the segmenter tells apart:
+LAYOUTS = ('daily', 'weekly by floor', 'weekly by day', 'not a menu')
+
+
+def _layout(parsed):
+    """Name the variant of menu post that was parsed"""
+    if parsed is None:
+        return 'not a menu'
+    if parsed.kind == 'daily':
+        return 'daily'
+    return 'weekly by floor' if parsed.by_floor else 'weekly by day'
+
+
+def _extract_daily(segments):
+    header = segments.header
+    menu = Menu(
+        trim_multiline(segments.floors['first'].text),
+        trim_multiline(segments.floors['third'].text),
+    )
+    return ParsedPost('daily', None, header.day, header.month, True, [menu])
+
+
+def _extract_by_floor(segments):
+    menus = [
+        Menu(first=first, third=third)
+        for first, third in zip(_floor_days(segments, 'first'), _floor_days(segments, 'third'))
+    ]
+    return ParsedPost('weekly', segments.header.weeknum, None, None, True, menus)
+
+
+def _extract_by_day(segments):
+    return ParsedPost('weekly', segments.header.weeknum, None, None, False, _day_menus(segments.days))
+
+
+# The extractor of each kind of menu post, from its segments:
+EXTRACTORS = {
+    WEEKLY_COMBINED: _extract_by_floor,
+    WEEKLY_SINGLE_FLOOR: _extract_by_floor,
+    DAILY_COMBINED: _extract_daily,
+    BY_DAY_FIRST: _extract_by_day,
+}
+
+
+IndexedPost = collections.namedtuple('IndexedPost', ('time', 'post', 'parsed'))
+
+
+class PostIndex(object):
+    """Menu posts indexed by time, date and week number
+
+    Each post is parsed once when the index is built, unless the parsed
+    posts are passed in. Lookups bisect the window of posts around a date,
+    and take the newest match in it.
+    """
+
+    def __init__(self, posts, cache=None, parsed=None, headers=floor_headers):
+        self.headers = headers
+        posts = list(posts)
+        if parsed is None:
+            parsed = [parse_post(post, cache, headers) for post in posts]
+        entries = []
+        for i, (post, parsed_post) in enumerate(zip(posts, parsed)):
+            dt = datetime.datetime.strptime(post['created_time'], TIME_FORMAT)
+            entries.append((dt.timestamp(), -i, post, parsed_post))
+        # Oldest first, and for equal times the one listed first last:
+        entries.sort(key=lambda entry: entry[:2])
+        self.times = [entry[0] for entry in entries]
+        self.entries = []
+        self.daily = collections.defaultdict(list)
+        self.weekly = collections.defaultdict(list)
+        for t, _, post, parsed in entries:
+            position = len(self.entries)
+            self.entries.append(IndexedPost(t, post, parsed))
+            if parsed is None:
+                continue
+            if parsed.kind == 'daily':
+                self.daily[(parsed.month, parsed.day)].append(position)
+            else:
+                self.weekly[parsed.weeknum].append(position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def window(self, date, days):
+        """Get the (start, stop) positions of posts within days of date"""
+        start = bisect.bisect_left(self.times, (date - datetime.timedelta(days=days)).timestamp())
+        stop = bisect.bisect_left(self.times, (date + datetime.timedelta(days=days + 1)).timestamp())
+        return start, stop
+
+    def newest(self, positions, window=None):
+        """Get the newest IndexedPost at positions within window, or None"""
+        start, stop = window if window is not None else (0, len(self.entries))
+        i = bisect.bisect_left(positions, stop)
+        if i > 0 and positions[i - 1] >= start:
+            return self.entries[positions[i - 1]]
+        return None
+
+
+def get_menus_for_day(posts, date, cache=None, index=None, window=None):
+    """Get the menu for the given date matching daily menu."""
+    if index is None:
+        index = PostIndex(posts, cache)
+    found = index.newest(index.daily.get((date.month, date.day), []), window)
+    if found is None:
+        return None
+    logger.info('Found post that matches a combined menu for this day')
+    logger.debug(found.post['message'])
+    return found.parsed.menus[0]
+
+
+def get_menus_for_week(posts, week_number, cache=None, index=None, window=None):
+    """Get the menu for the given week number, from the newest post for
+    that week, or empty menus if there is none"""
+    if index is None:
+        index = PostIndex(posts, cache)
+    found = index.newest(index.weekly.get(week_number, []), window)
+    if found is None:
+        logger.warning('No weekly menu found for week %s!', week_number)
         return [Menu() for i in range(5)]
+    logger.info('Found post that matches a menu for week %s', week_number)
+    return list(found.parsed.menus)
 
-    for pattern in patterns_combined:
-        match = pattern.search(message)
-        if match is not None and int(match.group('weeknum')) == week_number:
-            logger.info('Found post that matches a combined menu for this week')
-            week_first, week_third = match.group('first', 'third')
-            menu_first_floor = extract_menu(week_first)
-            menu_third_floor = extract_menu(week_third)
-            return [Menu(first=first, third=third) for first, third in zip(menu_first_floor, menu_third_floor)]
 
-    # weekly menu, by day first, not floor
+def _day_menus(days):
+    """Get the trimmed menus of a list of segmenter.Day blocks"""
     menus = []
-    for combined in extract_menu(message):
-        for pattern in patterns_daily:
-            match = pattern.search(combined)
-            if not match:
-                continue
-            first, third = match.group('first', 'third')
-            if first and third:
-                combined = None
-                break
-        menus.append(Menu(first=first, third=third, combined=combined))
+    for day in days:
+        first, third = day.floors.get('first'), day.floors.get('third')
+        if first and third:
+            menus.append(Menu(first=trim_multiline(first), third=trim_multiline(third)))
+        elif day.text is not None:
+            menus.append(Menu(combined=trim_multiline(day.text)))
+        else:
+            menus.append(Menu())
     return menus
 
 
-def is_matching_message(message, floor_patterns, week_number):
-    """Check if a message conatins a menu for given floor pattern and week number"""
+def _floor_days(segments, floor):
+    """Get the trimmed day menus of one floor in a floor-first post"""
+    if floor not in segments.floors:
+        return [None] * 5
+    return [
+        trim_multiline(text) if text is not None else None
+        for text in segments.floors[floor].days
+    ]
+
+
+def is_matching_message(message, floor_patterns, week_number, budget=None):
+    """Check if a message conatins a menu for given floor pattern and week number
+
+    Messages that take longer than `budget` seconds to check are treated as
+    not matching.
+    """
+    deadline = Deadline(PARSE_BUDGET if budget is None else budget)
     for floor_pattern in floor_patterns:
+        try:
+            deadline.check()
+        except ParseTimeout:
+            logger.warning('Giving up on message, matching took longer than %ss', deadline.budget)
+            return False
+        start = time.perf_counter()
         week_match = floor_pattern.search(message)
+        record_try(pattern_name(floor_pattern), week_match is not None, time.perf_counter() - start)
         if week_match is not None and int(week_match.group('weeknum')) == week_number:
             return True
     return False
@@ -261,30 +723,67 @@ def trim_multiline(text):
 def extract_menu(message):
     """Extract the menu from a message"""
     menu = [None] * 5
-    for day in range(5):
-        match = pattern_days[day].search(message)
-        if match and match.group(2):
+    for day, block in enumerate(split_days(message)):
+        if block:
             logger.info('Found menu for day %d', day)
-            logger.debug(match.groups())
-            menu[day] = trim_multiline(match.group(2))
+            logger.debug(block)
+            menu[day] = trim_multiline(block)
         else:
             logger.warning('Could not find menu for day %d.', day)
-            if match:
-                logger.warning('Match: %s', match.groups())
             logger.warning('Message: %r', message)
     return menu
 
 
 def main(args=None, post_menu=None):
     # Set up logging:
-    arguments = parser.parse_args(args)
+    arguments = get_parser().parse_args(args)
     if arguments.verbose:
         loglevel = 'DEBUG'
     else:
         loglevel = config.get('General', 'log-level', fallback='INFO')
     logging.basicConfig(level=loglevel)
 
-    run(post_menu=post_menu)
+    if arguments.profile_regex:
+        from .profiling import profile_patterns
+        profile_patterns()
+    try:
+        if arguments.profile:
+            from .profiling import run_profiled
+            run_profiled(arguments.profile, run_command, arguments, post_menu)
+        else:
+            run_command(arguments, post_menu)
+    finally:
+        if arguments.profile_regex:
+            from .profiling import PATTERNS
+            PATTERNS.report()
+
+
+def run_command(arguments, post_menu=None):
+    if arguments.command == 'backfill':
+        from .backfill import run_backfill
+        run_backfill(arguments)
+    elif arguments.command == 'search':
+        from .dishes import run_search
+        run_search(arguments)
+    elif arguments.command == 'archive':
+        from .archive import run_import
+        run_import(arguments)
+    elif arguments.command == 'ingest':
+        from .ingest import run_ingest
+        run_ingest(arguments)
+    elif arguments.command == 'serve':
+        from .serve import run_serve
+        run_serve(arguments)
+    elif arguments.command == 'patterns':
+        from .stats import run_report
+        run_report(arguments)
+    elif arguments.daemon:
+        from .daemon import run_daemon
+        run_daemon(post_menu=post_menu)
+    else:
+        # Cached posts are not parsed, so do without caches when timing the patterns:
+        cached = arguments.saved_page is None and not arguments.profile_regex
+        run(post_menu=post_menu, saved_page=arguments.saved_page, cached=cached)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Timings and counts of the stages of a run, in Prometheus text format.
+
+Metrics are kept for the life of the process, and written to a file for
+the node exporter's textfile collector after each run, so that a daemon
+accumulates them across runs, while a cron run writes those of one run.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import contextlib
+import io
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger('lunchbot')
+
+# Upper bounds of the buckets of duration histograms, in seconds:
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    'lunchbot_stage_seconds': 'Time spent in each stage of a run.',
+    'lunchbot_run_seconds': 'Time from start to end of a run.',
+    'lunchbot_last_run_timestamp_seconds': 'When the last run finished.',
+    'lunchbot_last_run_success': 'Whether the last run posted every menu.',
+    'lunchbot_fetched_bytes_total': 'Bytes of pages read.',
+    'lunchbot_fetches_total': 'Pages fetched, by how they were answered.',
+    'lunchbot_posts_scanned_total': 'Posts looked at for menus.',
+    'lunchbot_posts_matched_total': 'Posts found to be menus.',
+    'lunchbot_posts_parsed_total': 'Posts parsed, that were not in the parse cache.',
+    'lunchbot_patterns_tried_total': 'Pattern variants tried on posts, by variant and result.',
+    'lunchbot_source_results_total': 'Results of the sources of posts, by source and result.',
+    'lunchbot_slack_calls_total': 'Calls to the Slack API, by outcome.',
+    'lunchbot_slack_call_seconds': 'Latency of calls to the Slack API.',
+}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+
+
+class Metrics(object):
+    """Counters, gauges and histograms by name and labels"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        # (name, labels) -> [bucket counts..., sum, count]
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, _labels(labels))] += value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            key = (name, _labels(labels))
+            histogram = self.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage, **labels):
+        """Observe the time spent in the block as a stage of the run"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('lunchbot_stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def render(self):
+        """Get all metrics in the Prometheus text format"""
+        lines = []
+        with self.lock:
+            families = collections.defaultdict(list)
+            for (name, labels), value in self.counters.items():
+                families[(name, 'counter')].append((labels, value))
+            for (name, labels), value in self.gauges.items():
+                families[(name, 'gauge')].append((labels, value))
+            for (name, labels), value in self.histograms.items():
+                families[(name, 'histogram')].append((labels, list(value)))
+        for (name, kind), samples in sorted(families.items()):
+            if name in HELP:
+                lines.append('# HELP %s %s' % (name, HELP[name]))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(samples):
+                if kind != 'histogram':
+                    lines.append('%s%s %r' % (name, _format_labels(labels), float(value)))
+                    continue
+                for bound, count in zip(BUCKETS, value):
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', repr(float(bound)))]), count))
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', '+Inf')]), value[-1]))
+                lines.append('%s_sum%s %r' % (name, _format_labels(labels), float(value[-2])))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), value[-1]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to path, replacing it in one step, as the
+        textfile collector may read it at any time"""
+        path = os.path.expanduser(path)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with io.open(tmp, 'w', encoding='utf8') as f:
+            f.write(self.render())
+        os.rename(tmp, path)
+
+
+# The metrics of this process:
+METRICS = Metrics()
+
+
+def write_metrics(path):
+    """Write the metrics of this process to path, if set"""
+    if not path:
+        return
+    try:
+        METRICS.write(path)
+    except (IOError, OSError):
+        logger.exception('Could not write metrics to %s', path)
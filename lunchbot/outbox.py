@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""A durable queue of messages to post, so that no message is posted twice.
+
+Messages are put in a SQLite file, keyed by (date, channel, kind), before
+they are posted. A message that has been posted, or might have been, is
+never posted again under the same key, so a run can be repeated as often
+as wanted without spamming the channels: only the messages that did not
+go out are tried again. Failed posts are retried with exponential
+backoff, or after the Retry-After of a rate limited response, by the
+outbox alone: the messages are sent without retries of their own.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import datetime
+import logging
+import os
+import sqlite3
+import time
+
+
+logger = logging.getLogger('lunchbot')
+
+PENDING, SENDING, SENT, FAILED = 'pending', 'sending', 'sent', 'failed'
+
+Message = collections.namedtuple(
+    'Message', ('date', 'channel', 'kind', 'text', 'attempts', 'next_try')
+)
+
+
+def retry_delay(error, attempts, base=1.0, cap=60.0):
+    """Seconds to wait before trying again after a failure: the Retry-After
+    of a rate limited response, or an exponential backoff"""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        try:
+            return float(response.headers.get('Retry-After', base))
+        except (TypeError, ValueError):
+            pass
+    return min(cap, base * 2 ** attempts)
+
+
+class Outbox(object):
+    """A SQLite backed queue of messages to post, keyed by (date, channel, kind)"""
+
+    def __init__(self, path, max_attempts=5):
+        self.path = path
+        self.max_attempts = max_attempts
+        # Posters of several sites may share the file from their own threads:
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            ' date TEXT NOT NULL,'
+            ' channel TEXT NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' text TEXT NOT NULL,'
+            ' state TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL,'
+            ' next_try REAL NOT NULL,'
+            ' sent REAL,'
+            ' error TEXT,'
+            ' PRIMARY KEY (date, channel, kind))'
+        )
+        self.db.commit()
+
+    def put(self, date, channel, kind, text):
+        """Queue a message, unless one with the same key was already posted
+
+        A message that is still queued gets the newer text, and one that
+        failed is tried again from scratch.
+        """
+        key = (date.isoformat(), channel, kind)
+        with self.db:
+            self.db.execute(
+                'UPDATE messages SET text = ?, state = ?, attempts = 0, next_try = ?, error = NULL'
+                ' WHERE date = ? AND channel = ? AND kind = ? AND state IN (?, ?)',
+                (text, PENDING, time.time()) + key + (PENDING, FAILED),
+            )
+            self.db.execute(
+                'INSERT OR IGNORE INTO messages (date, channel, kind, text, state, attempts, next_try)'
+                ' VALUES (?, ?, ?, ?, ?, 0, ?)',
+                key + (text, PENDING, time.time()),
+            )
+
+    def state(self, date, channel, kind):
+        row = self.db.execute(
+            'SELECT state FROM messages WHERE date = ? AND channel = ? AND kind = ?',
+            (date.isoformat(), channel, kind),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def pending(self, keys=None):
+        """Get the queued messages, of the given (date, channel, kind) keys
+        if any, the first one due first"""
+        messages = [
+            Message(datetime.datetime.strptime(row[0], '%Y-%m-%d').date(), *row[1:])
+            for row in self.db.execute(
+                'SELECT date, channel, kind, text, attempts, next_try FROM messages'
+                ' WHERE state = ? ORDER BY next_try',
+                (PENDING,),
+            )
+        ]
+        if keys is not None:
+            keys = set(keys)
+            messages = [m for m in messages if (m.date, m.channel, m.kind) in keys]
+        return messages
+
+    def _claim(self, message):
+        # Marked as sending before posting, so that a crash while posting
+        # leaves it out of the queue rather than posted twice:
+        with self.db:
+            return self.db.execute(
+                'UPDATE messages SET state = ? WHERE date = ? AND channel = ? AND kind = ? AND state = ?',
+                (SENDING, message.date.isoformat(), message.channel, message.kind, PENDING),
+            ).rowcount == 1
+
+    def _finish(self, message, state, next_try=0.0, error=None):
+        with self.db:
+            self.db.execute(
+                'UPDATE messages SET state = ?, attempts = attempts + 1, next_try = ?, sent = ?, error = ?'
+                ' WHERE date = ? AND channel = ? AND kind = ?',
+                (state, next_try, time.time() if state == SENT else None, error,
+                 message.date.isoformat(), message.channel, message.kind),
+            )
+
+    def drain(self, send, keys=None, sleep=time.sleep, workers=8):
+        """Post the queued messages with send(channel, text), until each is
+        sent or has failed max_attempts times. Returns the last error, if
+        any failed.
+
+        The messages that are due are posted concurrently, by up to workers
+        threads, and only when none are due is the first one waited for, so
+        that a channel that is rate limited does not hold up the others.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        error = None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                messages = self.pending(keys)
+                if not messages:
+                    return error
+                now = time.time()
+                if messages[0].next_try > now:
+                    wait = messages[0].next_try - now
+                    sleep(wait)
+                    now += wait
+                # Claimed and finished here, as the database is not shared with the threads:
+                sending = [
+                    (message, pool.submit(send, message.channel, message.text))
+                    for message in messages if message.next_try <= now and self._claim(message)
+                ]
+                for message, future in sending:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        attempts = message.attempts + 1
+                        if attempts >= self.max_attempts:
+                            logger.exception('Giving up posting to %s after %d attempts', message.channel, attempts)
+                            self._finish(message, FAILED, error=str(e))
+                            error = e
+                            continue
+                        delay = retry_delay(e, message.attempts)
+                        logger.warning('Failed to post to %s, retrying in %.1fs: %s', message.channel, delay, e)
+                        self._finish(message, PENDING, time.time() + delay, str(e))
+                    else:
+                        self._finish(message, SENT)
+
+    def close(self):
+        self.db.close()
+
+
+def open_outbox(path):
+    """Open the outbox at path, or return None if it can not be opened"""
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    try:
+        return Outbox(path)
+    except sqlite3.Error:
+        logger.exception('Could not open outbox at %s, posting directly', path)
+        return None
+
+
+class QueuedPoster(object):
+    """Post messages to channels through the outbox at path
+
+    send(channel, text) posts a single message, without retrying, as the
+    outbox retries it. kind_of(text) tells what kind of message it is, as
+    only one of each kind is posted to a channel in a day. prefix tells
+    the kinds of different posters apart.
+    """
+
+    def __init__(self, send, channels, path, kind_of, prefix='', today=None, workers=8):
+        self.send = send
+        self.channels = channels
+        self.path = path
+        self.kind_of = kind_of
+        self.prefix = prefix
+        self.today = today or datetime.date.today
+        self.workers = workers
+
+    def post(self, message):
+        # Without the file, the messages are still posted and retried the
+        # same way, only not remembered after this run:
+        outbox = open_outbox(self.path) or Outbox(':memory:')
+        date, kind = self.today(), self.prefix + self.kind_of(message)
+        try:
+            for channel in self.channels:
+                outbox.put(date, channel, kind, message)
+            error = outbox.drain(
+                self.send, [(date, channel, kind) for channel in self.channels], workers=self.workers
+            )
+        finally:
+            outbox.close()
+        if error is not None:
+            raise error
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Profiling of a whole run, and of each pattern used to find and parse menus.
+
+--profile runs the command under cProfile, in every thread it starts, and
+dumps the stats to a file that pstats, snakeviz or flameprof can read.
+--profile-regex replaces the compiled patterns with ones that count their
+calls, the time spent in them and the slowest text they were given, and
+prints a table of them at exit.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import logging
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger('lunchbot')
+
+# Characters of the slowest input to show in the report:
+EXCERPT = 60
+
+
+def run_profiled(path, func, *args, **kwargs):
+    """Call func under cProfile, and write the stats to path"""
+    import cProfile
+    import pstats
+    profilers = [cProfile.Profile()]
+
+    def profile_thread(frame, event, arg):
+        # Profiles are per thread, so start one in each new thread:
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Newer Pythons profile all threads from the first profiler
+            return
+        profilers.append(profiler)
+
+    threading.setprofile(profile_thread)
+    profilers[0].enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profilers[0].disable()
+        threading.setprofile(None)
+        pstats.Stats(*profilers).dump_stats(path)
+        logger.info('Wrote profile to %s', path)
+
+
+class PatternProfile(object):
+    """Calls, time spent and slowest input by pattern name"""
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        # name -> [calls, seconds, slowest seconds, slowest input]
+        self.timings = {}
+
+    def record(self, name, seconds, text):
+        with self.lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0, None])
+            timing[0] += 1
+            timing[1] += seconds
+            if timing[3] is None or seconds > timing[2]:
+                timing[2] = seconds
+                timing[3] = text
+
+    def report(self, out=None):
+        """Print a line for each pattern, most time spent first"""
+        out = out or sys.stderr
+        print('%-36s %8s %10s %10s  %s' % ('pattern', 'calls', 'total (ms)', 'max (ms)', 'slowest input'), file=out)
+        with self.lock:
+            timings = sorted(self.timings.items(), key=lambda item: -item[1][1])
+        for name, (calls, seconds, slowest, text) in timings:
+            excerpt = text if len(text) <= EXCERPT else text[:EXCERPT - 3] + '...'
+            print('%-36s %8d %10.1f %10.2f  %r (%d chars)' % (
+                name, calls, 1000 * seconds, 1000 * slowest, excerpt, len(text),
+            ), file=out)
+
+
+class TimedPattern(object):
+    """A compiled pattern that records each call in a PatternProfile"""
+
+    def __init__(self, pattern, name, profile):
+        self.wrapped = pattern
+        self.name = name
+        self.profile = profile
+
+    def _timed(self, call, string):
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self.profile.record(self.name, time.perf_counter() - start, string)
+
+    def search(self, string, *args):
+        return self._timed(lambda: self.wrapped.search(string, *args), string)
+
+    def match(self, string, *args):
+        return self._timed(lambda: self.wrapped.match(string, *args), string)
+
+    def fullmatch(self, string, *args):
+        return self._timed(lambda: self.wrapped.fullmatch(string, *args), string)
+
+    def findall(self, string, *args):
+        return self._timed(lambda: self.wrapped.findall(string, *args), string)
+
+    def finditer(self, string, *args):
+        # Matched eagerly, so that the time of the whole scan is counted:
+        return iter(self._timed(lambda: list(self.wrapped.finditer(string, *args)), string))
+
+    def split(self, string, *args, **kwargs):
+        return self._timed(lambda: self.wrapped.split(string, *args, **kwargs), string)
+
+    def __getattr__(self, name):
+        # pattern, flags, groups and groupindex are those of the wrapped pattern:
+        return getattr(self.wrapped, name)
+
+    def __repr__(self):
+        return '<TimedPattern %s>' % self.name
+
+
+# The pattern timings of this process:
+PATTERNS = PatternProfile()
+
+
+def timed(pattern, name):
+    """Wrap a compiled pattern to be timed as name, if profiling patterns"""
+    if not PATTERNS.enabled:
+        return pattern
+    return TimedPattern(pattern, name, PATTERNS)
+
+
+def profile_patterns():
+    """Time every call of the patterns of main and the segmenter from now on
+
+    The pattern groups, floor headers and day keywords are compiled
+    again, and the segmenter's header patterns are replaced in place.
+    """
+    from . import main, segmenter
+    PATTERNS.enabled = True
+    main.get_patterns.cache_clear()
+    segmenter.compile_floor_headers.cache_clear()
+    segmenter.segment.cache_clear()
+    segmenter.day_keywords.cache_clear()
+    for name in ('week_header', 'daily_header'):
+        setattr(segmenter, name, timed(getattr(segmenter, name), name))
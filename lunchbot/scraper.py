@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Scan facebook pages for posts, as they are read"""
+
+from datetime import datetime
+import collections
+import logging
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+
+
+logger = logging.getLogger("lunchbot")
+
+# Bump when changing what is scanned from a page, so that posts scanned
+# before are not taken from the response cache:
+VERSION = 1
+
+
+# Elements that never have an end tag:
+VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+))
+
+
+class PostScanner(HTMLParser):
+    """Incrementally scan a facebook page for posts
+
+    Feed it the page in chunks, and posts are appended to `posts` as
+    (datetime, post) as soon as the end of each post has been read. Only
+    the stack of open elements and the text of the current post are kept,
+    never the whole document.
+
+    Each post is a dict that looks enough like the post object from the
+    API to be a drop-in replacement.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.posts = collections.deque()
+        self.stack = []
+        self._start_post(None)
+
+    def _start_post(self, depth):
+        self.post_depth = depth
+        self.content_depth = None
+        self.hide_depth = None
+        self.content_seen = False
+        self.timestamp = None
+        self.chunks = []
+        # Text can arrive split over several calls to handle_data:
+        self.text = []
+
+    def _flush_text(self):
+        if self.text:
+            self.chunks.append(''.join(self.text).strip() + ' ')
+            self.text = []
+
+    def _finish_post(self):
+        from pytz import timezone
+        self._flush_text()
+        if self.timestamp is None or not self.content_seen:
+            logger.debug('Skipping post without timestamp or content')
+        else:
+            dt = datetime.fromtimestamp(self.timestamp, timezone('UTC'))
+            message = ''.join(self.chunks).strip()
+            self.posts.append((dt, {"created_time": dt.isoformat(), "message": message}))
+        self._start_post(None)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        depth = len(self.stack)
+        if self.post_depth is None:
+            if 'userContentWrapper' in classes:
+                self._start_post(depth)
+        else:
+            if 'timestampContent' in classes and self.timestamp is None and self.stack:
+                utime = self.stack[-1][1].get('data-utime')
+                if utime is not None:
+                    self.timestamp = int(utime)
+            if self.content_depth is None:
+                if 'userContent' in classes and not self.content_seen:
+                    self.content_depth = depth
+                    self.content_seen = True
+            elif self.hide_depth is None:
+                if 'text_exposed_hide' in classes:
+                    self.hide_depth = depth
+                elif tag in ('br', 'p'):
+                    self.chunks.append('\n')
+        if tag not in VOID_ELEMENTS:
+            self.stack.append((tag, attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                break
+        else:
+            # Stray end tag, ignore it
+            return
+        del self.stack[i:]
+        depth = len(self.stack)
+        if self.hide_depth is not None and depth <= self.hide_depth:
+            self.hide_depth = None
+        if self.content_depth is not None and depth <= self.content_depth:
+            self.content_depth = None
+        if self.post_depth is not None and depth <= self.post_depth:
+            self._finish_post()
+
+    def handle_data(self, data):
+        if self.content_depth is not None and self.hide_depth is None:
+            self.text.append(data)
+
+
+def iter_posts(chunks, oldest=None, stale_limit=2):
+    """Scan chunks of a facebook page for posts, yielding them as found
+
+    If `oldest` is given, reading stops once `stale_limit` posts older than
+    it have been seen. More than one is needed, as pinned posts come first.
+    """
+    scanner = PostScanner()
+    stale = 0
+    for chunk in chunks:
+        scanner.feed(chunk)
+        while scanner.posts:
+            dt, post = scanner.posts.popleft()
+            yield post
+            if oldest is not None and dt < oldest:
+                stale += 1
+                if stale >= stale_limit:
+                    logger.debug('Passed %s, stopping', oldest)
+                    return
+    scanner.close()
+    for _, post in scanner.posts:
+        yield post
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Single pass segmentation of menu posts.
+
+A post is walked line by line once, and split into a small tree:
+
+    header -> floor sections -> weekday blocks   (floor-first layout)
+    header -> weekday blocks -> floor sections   (day-first layout)
+
+The line patterns below are only ever applied to a single line, and the
+gaps in them are bounded, so the cost of segmenting a post grows linearly
+with its length, however long its lines are.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import re
+import time
+import collections
+from functools import lru_cache
+
+from .dates import WEEKDAY_MISSPELLINGS, WEEKDAY_NAMES, WEEKDAYS, month_number, weekday_number
+from .keywords import keyword_pattern, within_one_typo
+from .profiling import timed
+
+
+FLOORS = ('first', 'third')
+
+# Menus are served Monday through Friday:
+DAY_NAMES = WEEKDAY_NAMES[:5]
+
+line_flags = re.IGNORECASE
+
+# The gaps are bounded, as in COMBINED_HEADER of main, so that a long line
+# of keywords is not scanned to its end again for each of them:
+week_header = re.compile(
+    r'(?:(?:Meny(?:er)?|Menus?)\b[^\n]{0,40}?(?:uke|week)|week|uke)[^\d\n]{0,40}?(?P<weeknum>\d+)',
+    flags=line_flags,
+)
+daily_header = re.compile(
+    r'(?:Meny(?:er)?|Menus?)[ \t]+(?:(?!uke\b|week\b)(?P<weekday>\w+)[ \t]*)?'
+    r'(?P<day>\d+)(?:st|nd|rd|th)?\.?[ \t]*(?P<month>[^\W\d_]+)',
+    flags=line_flags,
+)
+FLOOR_HEADER_SOURCES = (
+    ('first', r'TRANSIT|\b1\.?[ \t]*(?:etg|etasje|etage)\b'),
+    ('third', r'EXPEDITI?ON|EXPEDISJON|EKSPEDISJON|\b3\.?[ \t]*(?:etg|etasje|etage)\b'),
+)
+
+
+@lru_cache(None)
+def compile_floor_headers(sources=None):
+    """Compile (floor, pattern source) pairs for the floor header lines.
+
+    Floors without a source, or all floors if sources is None, use the
+    default patterns.
+    """
+    defaults = dict(FLOOR_HEADER_SOURCES)
+    sources = dict(sources or ())
+    return tuple(
+        (floor, timed(
+            re.compile(sources.get(floor) or defaults[floor], flags=line_flags), floor + ' floor header'
+        ))
+        for floor in FLOORS
+    )
+
+
+floor_headers = compile_floor_headers()
+
+
+@lru_cache(None)
+def day_keywords():
+    """Compile the names of the days, and their misspellings, into a single
+    trie pattern on first use"""
+    keywords = [name for names in DAY_NAMES for name in names]
+    keywords.extend(name for name, day in WEEKDAY_MISSPELLINGS if day < len(DAY_NAMES))
+    return timed(re.compile(keyword_pattern(keywords), flags=line_flags), 'day_keywords')
+
+# Characters stripped from the end of a day block, as in the old day patterns:
+TRAILING = ' \t\r\n\f\v-'
+
+
+Header = collections.namedtuple('Header', ('kind', 'weeknum', 'weekday', 'day', 'month'))
+Floor = collections.namedtuple('Floor', ('text', 'days'))
+Day = collections.namedtuple('Day', ('text', 'floors'))
+Segments = collections.namedtuple('Segments', ('header', 'floors', 'days'))
+
+
+class ParseTimeout(Exception):
+    """Raised when a message takes longer to parse than its budget"""
+
+
+class Deadline(object):
+    """A point in time that parsing of a message must finish by.
+
+    A budget of None or 0 never expires.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.end = time.monotonic() + budget if budget else None
+
+    def check(self):
+        if self.end is not None and time.monotonic() > self.end:
+            raise ParseTimeout('Parsing exceeded budget of %ss' % self.budget)
+
+
+NO_DEADLINE = Deadline()
+
+
+def _lines(text, deadline=NO_DEADLINE):
+    """Iterate (start, end) offsets of the lines in text"""
+    start = 0
+    length = len(text)
+    while start <= length:
+        deadline.check()
+        end = text.find('\n', start)
+        if end < 0:
+            end = length
+        yield start, end
+        start = end + 1
+
+
+@lru_cache(256)
+def day_of(word):
+    """Get the weekday of a day name or a misspelling of one, or None if
+    it is as close to the name of another day, weekends included"""
+    word = word.lower()
+    if word in WEEKDAYS:
+        return WEEKDAYS[word]
+    days = set(
+        day for day, names in enumerate(WEEKDAY_NAMES) for name in names if within_one_typo(word, name)
+    )
+    return days.pop() if len(days) == 1 else None
+
+
+def find_days(text):
+    """Iterate (match, weekday) of each mention of a weekday in text"""
+    for match in day_keywords().finditer(text):
+        day = day_of(match.group())
+        if day is not None and day < len(DAY_NAMES):
+            yield match, day
+
+
+def _match_header(line):
+    match = daily_header.search(line)
+    if match is not None and month_number(match.group('month')) is not None:
+        return Header(
+            'daily', None, weekday_number(match.group('weekday')),
+            int(match.group('day')), month_number(match.group('month')),
+        )
+    match = week_header.search(line)
+    if match is not None:
+        return Header('weekly', int(match.group('weeknum')), None, None, None)
+    return None
+
+
+def _match_floor(line, headers=floor_headers):
+    for floor, pattern in headers:
+        if pattern.search(line) is not None:
+            return floor
+    return None
+
+
+def split_floors(text, deadline=NO_DEADLINE, headers=floor_headers):
+    """Split text on the first header line of each floor.
+
+    headers are the (floor, pattern) pairs to find the header lines with.
+    Returns an ordered mapping of floor name to the text following its
+    header line, up to the next floor header (or the end of the text).
+    """
+    found = []
+    for start, end in _lines(text, deadline):
+        floor = _match_floor(text[start:end], headers)
+        if floor is not None and floor not in [f for f, _, _ in found]:
+            found.append((floor, start, end))
+            if len(found) == len(FLOORS):
+                break
+    sections = collections.OrderedDict()
+    for i, (floor, start, end) in enumerate(found):
+        stop = found[i + 1][1] if i + 1 < len(found) else len(text)
+        sections[floor] = text[end + 1:stop].strip()
+    return sections
+
+
+def split_days(text, deadline=NO_DEADLINE):
+    """Split text into blocks for each weekday, Monday through Friday.
+
+    A block starts after the first mention of its weekday, and ends before
+    the first following line that mentions a later weekday. Missing blocks
+    are None.
+    """
+    hits = []
+    line_start = prev = 0
+    for match, day in find_days(text):
+        deadline.check()
+        newline = text.rfind('\n', prev, match.start())
+        if newline >= 0:
+            line_start = newline + 1
+        prev = match.start()
+        hits.append((line_start, match.end(), day))
+
+    blocks = [None] * len(DAY_NAMES)
+    seen = set()
+    for i, (_, end, day) in enumerate(hits):
+        if day in seen:
+            continue
+        seen.add(day)
+        start = end
+        if text.startswith(':', start):
+            start += 1
+        while start < len(text) and text[start].isspace():
+            start += 1
+        if day == len(DAY_NAMES) - 1:
+            stop = len(text)
+        else:
+            stop = None
+            for line_start, _, later_day in hits[i + 1:]:
+                if later_day > day and line_start > start:
+                    stop = line_start
+                    break
+            if stop is None:
+                continue
+        blocks[day] = text[start:stop].rstrip(TRAILING) or None
+    return blocks
+
+
+def split_day_blocks(text, deadline=NO_DEADLINE, headers=floor_headers):
+    """Split text into weekday blocks, each split further by floor"""
+    return [
+        Day(block, split_floors(block, deadline, headers) if block is not None else {})
+        for block in split_days(text, deadline)
+    ]
+
+
+@lru_cache(256)
+def segment(message, budget=None, headers=floor_headers):
+    """Segment a menu post into a Segments tree.
+
+    If a floor header comes before the first weekday, the post is laid out
+    by floor and `floors` is filled. Otherwise it is laid out by day, and
+    `days` is filled. The layout that is not used is left empty.
+
+    Floor header lines are found with `headers`, as from
+    compile_floor_headers. Raises ParseTimeout if segmenting takes longer
+    than `budget` seconds.
+    """
+    deadline = Deadline(budget)
+    header = None
+    header_start = header_end = 0
+    first_floor = first_day = None
+    for start, end in _lines(message, deadline):
+        line = message[start:end]
+        if header is None and first_day is None:
+            header = _match_header(line)
+            if header is not None:
+                header_start, header_end = start, end + 1
+        if first_floor is None and _match_floor(line, headers) is not None:
+            first_floor = start
+        if first_day is None and start >= header_end and next(find_days(line), None) is not None:
+            first_day = start
+        if first_floor is not None and first_day is not None:
+            break
+
+    if first_floor is not None and (first_day is None or first_floor <= first_day):
+        floors = collections.OrderedDict(
+            (floor, Floor(text, split_days(text, deadline)))
+            for floor, text in split_floors(message[header_start:], deadline, headers).items()
+        )
+        return Segments(header, floors, [])
+
+    return Segments(
+        header, collections.OrderedDict(), split_day_blocks(message[header_end:], deadline, headers)
+    )
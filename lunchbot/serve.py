@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Serve the menus as JSON over HTTP, for dashboards and chat bots.
+
+    GET /menu/today         the menu of today
+    GET /menu/YYYY-MM-DD    the menu of a date
+    GET /menu/week/N        the menus of each weekday of week N this year
+
+with ?site=NAME for another than the first site. The posts of each site
+are fetched and parsed into a PostIndex in the background, every
+refresh-minutes of [Serve], and requests are only answered from them, so
+that facebook is never waited for on the request path. The index of a
+site is replaced whole once the new one is built.
+
+Responses are kept as encoded JSON until the next refresh. Concurrent
+requests for a response that is not there yet wait for the first of them
+to build it, instead of each building their own.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import datetime
+import json
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from pytz import timezone
+
+from .config import SERVE_HOST, SERVE_PORT, SERVE_REFRESH_MINUTES, SITES, SITE_WORKERS
+from .fetch import make_session, saved_page_session
+from .main import MENU_WINDOW_DAYS, fetch_site_index, get_menus, render_menu
+
+
+logger = logging.getLogger('lunchbot')
+
+TIMEZONE = timezone('Europe/Oslo')
+
+# Posts are fetched this far back, so that the menus of every date
+# within the menu window of today can be looked up:
+INDEX_DAYS = 2 * MENU_WINDOW_DAYS
+
+DATE_PATH = re.compile(r'^/menu/(\d{4}-\d{2}-\d{2})$')
+WEEK_PATH = re.compile(r'^/menu/week/(\d{1,2})$')
+
+
+class NotFound(Exception):
+    pass
+
+
+class NotReady(Exception):
+    pass
+
+
+def noon(day):
+    return TIMEZONE.localize(datetime.datetime.combine(day, datetime.time(12)))
+
+
+def menu_json(menu):
+    data = menu._asdict()
+    data['text'] = '\n\n'.join(render_menu(menu))
+    return data
+
+
+class MenuService(object):
+    """The menus of sites, looked up in indexes of their posts
+
+    load(site, date) gets a PostIndex of the posts of a site up to date,
+    and is only called by refresh.
+    """
+
+    def __init__(self, load, sites=SITES):
+        self.load = load
+        self.sites = dict((site.name, site) for site in sites)
+        self.default_site = sites[0].name
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.today = {}
+        # Responses by key, replaced whole by each refresh:
+        self.responses = {}
+        self.building = {}
+
+    def now(self):
+        return datetime.datetime.now(TIMEZONE)
+
+    def refresh(self):
+        """Fetch and index the posts of every site again, keeping the old
+        index of a site that fails"""
+        now = self.now()
+        loaded = {}
+        for name, site in self.sites.items():
+            try:
+                loaded[name] = self.load(site, now)
+            except Exception:
+                logger.exception('Failed to refresh the posts of %s', name)
+        with self.lock:
+            for name, index in loaded.items():
+                self.indexes[name] = index
+                self.today[name] = now.date()
+            self.responses = {}
+        logger.info('Refreshed the posts of %s', ', '.join(sorted(loaded)) or 'no sites')
+        return len(loaded) == len(self.sites)
+
+    def response(self, key, build):
+        """Get the response for key, building it with build() unless it is
+        there, or another thread is already building it"""
+        while True:
+            with self.lock:
+                responses = self.responses
+                if key in responses:
+                    return responses[key]
+                event = self.building.get(key)
+                if event is None:
+                    event = self.building[key] = threading.Event()
+                    break
+            # Built by another thread, or failed there and is built here:
+            event.wait()
+        try:
+            value = build()
+            # Not kept if refreshed in the meantime, as it may be stale:
+            with self.lock:
+                responses[key] = value
+            return value
+        finally:
+            with self.lock:
+                del self.building[key]
+            event.set()
+
+    def _index(self, site):
+        with self.lock:
+            index = self.indexes.get(site)
+            today = self.today.get(site)
+        if index is None:
+            raise NotReady('The posts of %s are not loaded yet' % site)
+        return index, today
+
+    def _check_range(self, first, last, today):
+        window = datetime.timedelta(days=MENU_WINDOW_DAYS)
+        if last < today - window or first > today + window:
+            raise NotFound('Only menus within %d days of today are served' % MENU_WINDOW_DAYS)
+
+    def menu(self, site, day):
+        index, today = self._index(site)
+        if day is None:
+            day = today
+        self._check_range(day, day, today)
+
+        def build():
+            menu = get_menus(None, noon(day), index=index)
+            return _encode(dict(site=site, date=day.isoformat(), menu=menu_json(menu)))
+        return self.response((site, day), build)
+
+    def week(self, site, number):
+        index, today = self._index(site)
+        year = today.isocalendar()[0]
+        try:
+            days = [datetime.date.fromisocalendar(year, number, weekday) for weekday in range(1, 6)]
+        except ValueError:
+            raise NotFound('No week %d in %d' % (number, year))
+        self._check_range(days[0], days[-1], today)
+
+        def build():
+            menus = [
+                dict(date=day.isoformat(), menu=menu_json(get_menus(None, noon(day), index=index)))
+                for day in days
+            ]
+            return _encode(dict(site=site, year=year, week=number, days=menus))
+        return self.response((site, 'week', number), build)
+
+    def handle(self, url):
+        """Get (status, body) for the path and query of a request"""
+        parts = urlsplit(url)
+        site = parse_qs(parts.query).get('site', [self.default_site])[0]
+        try:
+            if site not in self.sites:
+                raise NotFound('Unknown site %r' % site)
+            if parts.path == '/menu/today':
+                return 200, self.menu(site, None)
+            match = DATE_PATH.match(parts.path)
+            if match:
+                try:
+                    day = datetime.datetime.strptime(match.group(1), '%Y-%m-%d').date()
+                except ValueError:
+                    raise NotFound('Not a date: %s' % match.group(1))
+                return 200, self.menu(site, day)
+            match = WEEK_PATH.match(parts.path)
+            if match:
+                return 200, self.week(site, int(match.group(1)))
+            raise NotFound('Not found: %s' % parts.path)
+        except NotFound as e:
+            return 404, _encode(dict(error=str(e)))
+        except NotReady as e:
+            return 503, _encode(dict(error=str(e)))
+
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, sort_keys=True).encode('utf8')
+
+
+def handler_for(service):
+    """Make a request handler class answering from service"""
+
+    class MenuHandler(BaseHTTPRequestHandler):
+        # Keep connections open between requests:
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            try:
+                status, body = service.handle(self.path)
+            except Exception:
+                logger.exception('Failed to answer %s', self.path)
+                status, body = 500, _encode(dict(error='Internal error'))
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if status == 503:
+                self.send_header('Retry-After', '10')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug('%s %s', self.address_string(), format % args)
+
+    return MenuHandler
+
+
+def refresh_forever(service, stopped, interval):
+    while not stopped.wait(interval):
+        service.refresh()
+
+
+def run_serve(arguments):
+    host = arguments.host or SERVE_HOST
+    port = arguments.port or SERVE_PORT
+    sources = None
+    if arguments.saved_page is not None:
+        session, sources = saved_page_session(arguments.saved_page), ['scraper']
+    else:
+        session = make_session(SITE_WORKERS)
+    service = MenuService(lambda site, date: fetch_site_index(site, date, session, INDEX_DAYS, sources))
+    server = ThreadingHTTPServer((host, port), handler_for(service))
+    server.daemon_threads = True
+    stopped = threading.Event()
+    # Load before serving, and keep refreshing from then on:
+    service.refresh()
+    refresher = threading.Thread(
+        target=refresh_forever, args=(service, stopped, SERVE_REFRESH_MINUTES * 60)
+    )
+    refresher.daemon = True
+    refresher.start()
+    logger.info('Serving the menus at http://%s:%d/menu/today', host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopping server')
+    finally:
+        stopped.set()
+        server.server_close()
+        session.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Get the posts of a site from whichever source gives a menu first.
+
+Each source is a function of (site, oldest, fetcher) that gets the posts
+of a site back to oldest, newest first:
+
+    scraper   the facebook page of the site, scraped
+    graph     the posts of the page from the Graph API
+    archive   the archive of the site, kept up to date by ingest
+
+Facebook may hang for tens of seconds, or change its HTML, so the sources
+in [Sources] order are raced: the first one is started, and the next is
+started as soon as one fails or gives posts without a menu, or when no
+menu has come within hedge-seconds. The first posts with a menu win, and
+the sources that have not answered by then are cancelled or abandoned.
+Waiting ends at timeout-seconds, with the posts of any source that
+answered, so a run takes at most that long to get its menu.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import logging
+import os
+import time
+
+from .apiwrappers import authenticated_graph, scrape_posts
+from .config import FACEBOOK_ID, FACEBOOK_SECRET, SOURCE_HEDGE_SECONDS, SOURCE_ORDER, SOURCE_TIMEOUT
+from .metrics import METRICS
+
+
+logger = logging.getLogger('lunchbot')
+
+
+def scraper_source(site, oldest, fetcher):
+    return scrape_posts(site.page, fetcher, oldest=oldest)
+
+
+def graph_source(site, oldest, fetcher):
+    from .ingest import new_posts
+    graph = authenticated_graph(FACEBOOK_ID, FACEBOOK_SECRET, fetcher)
+    # Paging stops at the first page that reaches oldest:
+    return new_posts(graph, site.page, (oldest, ''))
+
+
+def archive_source(site, oldest, fetcher):
+    from .backfill import read_post, scan_posts
+    path = os.path.expanduser(site.archive)
+    posts = [read_post(source) for day, source in scan_posts(path) if day >= oldest.date()]
+    return posts[::-1]
+
+
+SOURCES = collections.OrderedDict([
+    ('scraper', scraper_source),
+    ('graph', graph_source),
+    ('archive', archive_source),
+])
+
+
+def available_sources(site, order=None):
+    """Get the names of the sources in order that can be used for site"""
+    names = []
+    for name in SOURCE_ORDER if order is None else order:
+        if name not in SOURCES:
+            raise ValueError('Unknown source %r, expected one of %s' % (name, ', '.join(SOURCES)))
+        if name == 'graph' and None in (FACEBOOK_ID, FACEBOOK_SECRET):
+            continue
+        if name == 'archive' and not (site.archive and os.path.exists(os.path.expanduser(site.archive))):
+            continue
+        names.append(name)
+    return names
+
+
+def first_usable(names, fetch, check, hedge=SOURCE_HEDGE_SECONDS, timeout=SOURCE_TIMEOUT):
+    """Race the sources in names, hedged, and get the first usable result
+
+    fetch(name) is called in a thread of its own, and check(name, result)
+    in the calling thread as each result comes in. check returns a value
+    and whether it is usable. Returns the value of the first usable
+    result, or else of the first result in, or raises the first error if
+    no source gave a result at all.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    pool = ThreadPoolExecutor(max_workers=max(1, len(names)))
+    waiting = collections.deque(names)
+    running = {}
+    deadline = time.monotonic() + timeout
+    next_start = time.monotonic()
+    fallback = error = None
+    try:
+        while waiting or running:
+            now = time.monotonic()
+            if waiting and (not running or now >= next_start):
+                name = waiting.popleft()
+                logger.debug('Fetching posts from %s', name)
+                running[pool.submit(fetch, name)] = name
+                next_start = now + hedge
+                continue
+            if now >= deadline:
+                logger.warning('No menu from %s within %ss', ', '.join(running.values()), timeout)
+                break
+            until = min(deadline, next_start) if waiting else deadline
+            done, _ = wait(list(running), timeout=until - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning('Failed to get posts from %s: %s', name, e)
+                    METRICS.inc('lunchbot_source_results_total', source=name, result='failed')
+                    error = error or e
+                    next_start = time.monotonic()
+                    continue
+                value, usable = check(name, result)
+                if usable:
+                    logger.info('Using the posts from %s', name)
+                    METRICS.inc('lunchbot_source_results_total', source=name, result='used')
+                    return value
+                METRICS.inc('lunchbot_source_results_total', source=name, result='no menu')
+                if fallback is None:
+                    fallback = (value,)
+                next_start = time.monotonic()
+    finally:
+        # Sources still running are left to finish within their timeouts:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if fallback is not None:
+        return fallback[0]
+    if error is not None:
+        raise error
+    raise ValueError('No posts from %s within %ss' % (', '.join(names), timeout))
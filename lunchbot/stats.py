@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Hit statistics of the pattern variants used to recognize menus.
+
+For each variant the number of hits and misses, the time spent in it and
+the date of the newest post it matched are counted. The counts are kept
+in SQLite between runs, so that variants that no longer match anything
+show up in the report.
+
+The variants are those of the segmenter, which parses every post: each
+alternative of its floor headers, its week and daily headers, and the
+layouts it finds.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger('lunchbot')
+
+Counts = collections.namedtuple('Counts', ('hits', 'misses', 'seconds', 'last_hit'))
+
+
+class PatternStats(object):
+    """Counts of hits and misses by variant name, added to those on disk on save"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.saved = {}
+        self.added = {}
+
+    def record(self, name, hit, seconds, when=None):
+        """Count a try of variant name, and the date of the post if it hit"""
+        with self.lock:
+            hits, misses, spent, last_hit = self.added.get(name, (0, 0, 0.0, None))
+            if hit:
+                hits += 1
+                if when is not None and (last_hit is None or when > last_hit):
+                    last_hit = when
+            else:
+                misses += 1
+            self.added[name] = Counts(hits, misses, spent + seconds, last_hit)
+
+    def counts(self, name):
+        """Get the total Counts of a variant, saved and added"""
+        saved = self.saved.get(name, Counts(0, 0, 0.0, None))
+        added = self.added.get(name, Counts(0, 0, 0.0, None))
+        last = [when for when in (saved.last_hit, added.last_hit) if when is not None]
+        return Counts(
+            saved.hits + added.hits,
+            saved.misses + added.misses,
+            saved.seconds + added.seconds,
+            max(last) if last else None,
+        )
+
+    def names(self):
+        return sorted(set(self.saved) | set(self.added))
+
+    def hit_rate(self, name):
+        # Smoothed, so that untried variants are neither first nor last:
+        counts = self.counts(name)
+        return (counts.hits + 1.0) / (counts.hits + counts.misses + 2.0)
+
+    def load(self, path):
+        """Read the saved counts from the SQLite file at path"""
+        db = _connect(path)
+        try:
+            self.saved = dict(
+                (row[0], Counts(*row[1:]))
+                for row in db.execute('SELECT name, hits, misses, seconds, last_hit FROM patterns')
+            )
+        finally:
+            db.close()
+
+    def save(self, path):
+        """Add the counts recorded since loading to the SQLite file at path"""
+        with self.lock:
+            db = _connect(path)
+            try:
+                for name, counts in self.added.items():
+                    db.execute(
+                        'INSERT OR IGNORE INTO patterns (name, hits, misses, seconds) VALUES (?, 0, 0, 0)',
+                        (name,),
+                    )
+                    db.execute(
+                        'UPDATE patterns SET hits = hits + ?, misses = misses + ?, seconds = seconds + ?,'
+                        ' last_hit = MAX(COALESCE(last_hit, ?), COALESCE(?, last_hit))'
+                        ' WHERE name = ?',
+                        (counts.hits, counts.misses, counts.seconds, counts.last_hit, counts.last_hit, name),
+                    )
+                db.commit()
+            finally:
+                db.close()
+            self.added = {}
+        self.load(path)
+
+
+def _connect(path):
+    db = sqlite3.connect(os.path.expanduser(path))
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS patterns ('
+        ' name TEXT PRIMARY KEY,'
+        ' hits INTEGER NOT NULL,'
+        ' misses INTEGER NOT NULL,'
+        ' seconds REAL NOT NULL,'
+        ' last_hit TEXT)'
+    )
+    return db
+
+
+# The statistics of this process:
+STATS = PatternStats()
+
+
+def load_stats(path):
+    """Load the saved statistics at path, if any, into STATS"""
+    if not path:
+        return
+    try:
+        STATS.load(path)
+    except sqlite3.Error:
+        logger.exception('Could not load pattern statistics from %s', path)
+
+
+def save_stats(path):
+    """Save the statistics recorded by this process at path"""
+    if not path:
+        return
+    try:
+        STATS.save(path)
+    except sqlite3.Error:
+        logger.exception('Could not save pattern statistics to %s', path)
+
+
+def alternatives(source):
+    """Split a pattern source on its top level |, into the variants it
+    matches"""
+    parts, depth, start, escaped = [], 0, 0, False
+    for i, char in enumerate(source):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            parts.append(source[start:i])
+            start = i + 1
+    return parts + [source[start:]]
+
+
+def segmenter_variants():
+    """Get (name, compiled pattern) of each variant of the segmenter's
+    header patterns"""
+    from .segmenter import FLOOR_HEADER_SOURCES, daily_header, line_flags, week_header
+    variants = [
+        ('%s floor:%s' % (floor, variant), re.compile(variant, flags=line_flags))
+        for floor, source in FLOOR_HEADER_SOURCES
+        for variant in alternatives(source)
+    ]
+    return variants + [('week header', week_header), ('daily header', daily_header)]
+
+
+def count_archive(path):
+    """Try every variant of the segmenter on every post in an archive, as
+    for backfill"""
+    from .backfill import read_post, scan_posts
+    from .main import parse_post
+    from .segmenter import compile_floor_headers
+    # Not the default argument, which --profile-regex can not replace:
+    headers = compile_floor_headers()
+    variants = segmenter_variants()
+    for day, source in scan_posts(path):
+        message = read_post(source)['message']
+        for name, pattern in variants:
+            start = time.perf_counter()
+            match = pattern.search(message)
+            STATS.record(name, match is not None, time.perf_counter() - start, day.isoformat())
+        parse_post(dict(message=message, created_time=day.isoformat()), headers=headers)
+
+
+def print_report(stats, since=None):
+    """Print the counts of each variant, marking those that are dead weight"""
+    names = stats.names()
+    last = [stats.counts(name).last_hit for name in names]
+    last = [when for when in last if when is not None]
+    if since is None and last:
+        newest = datetime.datetime.strptime(max(last), '%Y-%m-%d').date()
+        since = newest - datetime.timedelta(days=365)
+    print('%-32s %8s %8s %6s %10s %10s' % ('variant', 'hits', 'tries', 'rate', 'time (ms)', 'last hit'))
+    for name in sorted(names, key=lambda name: -stats.hit_rate(name)):
+        counts = stats.counts(name)
+        tries = counts.hits + counts.misses
+        dead = counts.last_hit is None or (since is not None and counts.last_hit < since.isoformat())
+        print('%-32s %8d %8d %5.0f%% %10.1f %10s%s' % (
+            name, counts.hits, tries, 100.0 * counts.hits / tries if tries else 0,
+            1000 * counts.seconds, counts.last_hit or '-', '  dead' if dead else '',
+        ))
+    if since is not None:
+        print('Variants marked dead have not matched since %s' % since)
+
+
+def run_report(arguments):
+    from .config import STATS_PATH
+    load_stats(STATS_PATH)
+    if arguments.historical:
+        count_archive(arguments.historical)
+        save_stats(STATS_PATH)
+    print_report(STATS, arguments.since)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Replay the menu pipeline over the historical posts, and time it.
+
+For the week of each post in tests/historical.posts, the posts from the
+menu window before it to the end of the week go through the pipeline as
+in a run: filter_messages and parsing into a PostIndex, get_menus for each
+weekday, and render_menu into the Slack text. Parsed posts are not kept
+from one week to the next, like in separate runs.
+
+Reports posts parsed per second, percentiles of the latency of each
+stage, and the peak memory allocated while replaying, measured in a
+separate pass as tracing allocations slows it down.
+
+The results can be saved as a baseline, and later runs compared to it.
+Exits with status 1 if a run is more than TOLERANCE slower than the
+baseline in posts per second or the median of a stage, or uses more
+than TOLERANCE more memory.
+
+Usage: python -m lunchbot.tests.bench_replay [--runs N] [--save FILE] [--compare FILE]
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from lunchbot.apiwrappers import filter_messages
+from lunchbot.backfill import TIMEZONE, monday, read_post, scan_posts
+from lunchbot.main import MENU_WINDOW_DAYS, PostIndex, get_menus, render_menu
+from lunchbot.segmenter import segment
+
+
+TOLERANCE = 0.2
+PERCENTILES = (50, 90, 99)
+STAGES = ('index', 'get_menus', 'render_menu')
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+
+def load_weeks(path=os.path.join(here, 'historical.posts')):
+    """Get (monday, posts newest first) for the week of each historical post"""
+    posts = [(day, read_post(source)) for day, source in scan_posts(path)]
+    weeks = []
+    for day in sorted(set(monday(day) for day, _ in posts)):
+        first = day - datetime.timedelta(days=MENU_WINDOW_DAYS)
+        last = day + datetime.timedelta(days=4)
+        weeks.append((day, [post for posted, post in reversed(posts) if first <= posted <= last]))
+    return weeks
+
+
+def replay(weeks):
+    """Run the pipeline for every weekday of weeks, and get the number of
+    posts parsed and the latencies of each stage, in seconds"""
+    latencies = collections.defaultdict(list)
+    count = 0
+    for week, posts in weeks:
+        segment.cache_clear()
+        start = time.perf_counter()
+        index = PostIndex(filter_messages(posts))
+        latencies['index'].append(time.perf_counter() - start)
+        count += len(posts)
+        for weekday in range(5):
+            date = TIMEZONE.localize(
+                datetime.datetime.combine(week + datetime.timedelta(days=weekday), datetime.time(12))
+            )
+            start = time.perf_counter()
+            menu = get_menus(None, date, index=index)
+            latencies['get_menus'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            render_menu(menu)
+            latencies['render_menu'].append(time.perf_counter() - start)
+    return count, latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100. * (len(values) - 1))))]
+
+
+def measure(weeks, runs=3):
+    """Replay weeks runs times, and summarize the fastest run"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        count, latencies = replay(weeks)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = elapsed, count, latencies
+    elapsed, count, latencies = best
+
+    tracemalloc.start()
+    try:
+        replay(weeks)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return dict(
+        python=platform.python_version(),
+        weeks=len(weeks),
+        posts=count,
+        posts_per_second=count / elapsed,
+        peak_memory_kb=peak // 1024,
+        stages=dict(
+            (stage, dict(
+                ('p%d_ms' % p, 1000 * percentile(latencies[stage], p)) for p in PERCENTILES
+            ))
+            for stage in STAGES
+        ),
+    )
+
+
+def report(result):
+    print('Replayed %(weeks)d weeks, %(posts)d posts: %(posts_per_second).0f posts/s,'
+          ' peak memory %(peak_memory_kb)d kB' % result)
+    print('  %-12s %s' % ('stage', ' '.join('%9s' % ('p%d (ms)' % p) for p in PERCENTILES)))
+    for stage in STAGES:
+        print('  %-12s %s' % (
+            stage, ' '.join('%9.3f' % result['stages'][stage]['p%d_ms' % p] for p in PERCENTILES)
+        ))
+
+
+def compare(result, baseline, tolerance=TOLERANCE):
+    """Print how result compares to baseline, and get the regressions"""
+    changes = [('posts/s', baseline['posts_per_second'], result['posts_per_second'], False)]
+    changes += [
+        ('%s p50' % stage, baseline['stages'][stage]['p50_ms'], result['stages'][stage]['p50_ms'], True)
+        for stage in STAGES
+    ]
+    changes.append(('peak kB', baseline['peak_memory_kb'], result['peak_memory_kb'], True))
+    regressions = []
+    print('Compared to the baseline:')
+    for name, before, after, lower_is_better in changes:
+        ratio = after / before if before else 1.0
+        worse = ratio - 1 > tolerance if lower_is_better else 1 - ratio > tolerance
+        print('  %-20s %10.3f -> %10.3f  %+6.1f%%%s' % (
+            name, before, after, 100 * (ratio - 1), '  REGRESSION' if worse else ''
+        ))
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Replay the menu pipeline over the historical posts')
+    parser.add_argument('--runs', type=int, default=3, help='timed runs, the fastest is kept (default: 3)')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results to a saved baseline')
+    arguments = parser.parse_args(args)
+    # Not the warnings about posts, only the numbers:
+    logging.basicConfig(level='ERROR')
+
+    result = measure(load_weeks(), arguments.runs)
+    report(result)
+    ok = True
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            ok = not compare(result, json.load(f))
+    if arguments.save:
+        with open(arguments.save, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Measure the time it takes to import lunchbot.main.
+
+Runs `python -X importtime -c "import lunchbot.main"` a few times in fresh
+interpreters, and reports the median cumulative import time of
+lunchbot.main, along with the slowest modules it pulls in.
+
+Budget: importing lunchbot.main should take less than BUDGET_MS, and must
+not import any of the network backends in HEAVY. Those are only imported
+when fetching or posting. Exits with status 1 if the budget is exceeded.
+
+Usage: python -m lunchbot.tests.bench_startup [runs]
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+
+BUDGET_MS = 60
+HEAVY = ('requests', 'bs4', 'facepy', 'slack', 'aiohttp')
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def import_times():
+    """Import lunchbot.main in a fresh interpreter, and get the cumulative
+    import time of it and each module it imports, in microseconds"""
+    code = 'import lunchbot.main, sys; print(" ".join(sys.modules))'
+    # Bytecode is written, as when installed, so that compiling is not timed:
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=root,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    # Modules are listed after the modules they import, and only nested
+    # imports are indented after the separating space:
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+        if not name[1:].startswith(' '):
+            if name.strip() == 'lunchbot.main':
+                break
+            times = {}
+    return times, proc.stdout.split()
+
+
+def median_import_time(runs=5):
+    """Get the median import time of lunchbot.main over runs in ms, and
+    the import times and modules of the last run"""
+    # Once first, to write any bytecode that is out of date:
+    import_times()
+    totals = []
+    for _ in range(runs):
+        times, modules = import_times()
+        totals.append(times['lunchbot.main'] / 1000.)
+    totals.sort()
+    return totals[len(totals) // 2], times, modules
+
+
+def main(runs=5):
+    median, times, modules = median_import_time(runs)
+
+    print('Slowest imports by lunchbot.main (last run, cumulative):')
+    for name, us in sorted(times.items(), key=lambda item: -item[1])[:10]:
+        print('  %8.1f ms  %s' % (us / 1000., name))
+    print('lunchbot.main: median %.1f ms over %d runs (budget %d ms)' % (median, runs, BUDGET_MS))
+
+    heavy = sorted(m for m in modules if m.split('.')[0] in HEAVY)
+    if heavy:
+        print('Imported backends at startup: %s' % ', '.join(heavy))
+    return median <= BUDGET_MS and not heavy
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sys.exit(0 if main(runs) else 1)
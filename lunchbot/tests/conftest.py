@@ -3,7 +3,7 @@
 
 import io
 import os
-import glob
+import threading
 from datetime import datetime, date
 from collections import defaultdict
 try:
@@ -13,69 +13,46 @@ except ImportError:
 
 from pytz import timezone
 import pytest
+try:
+    from http.server import HTTPServer
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+
+from lunchbot.archive import PostArchive
+from lunchbot.tests.make_fuzz import CORPUS
 
 here = os.path.abspath(os.path.dirname(__file__))
 
 
-# Menus where the menu was posted in a different week:
-weeknum_override = {
-    '161216-third.txt': (2016, 51),
-    '161007-first.txt': (2016, 41),
-    '160704-third.txt': (2016, 26),
-    '160226-first.txt': (2016, 9),
-    '160219-third.txt': (2016, 8),
-    '160122-first.txt': (2016, 4),
-    '160122-third.txt': (2016, 4),
-    '160108-first.txt': (2016, 2),
-    '160108-third.txt': (2016, 2),
-    '180622-combined.txt': (2018, 26),
-    '190104-combined.txt': (2019, 2),
-}
-
-# Days that are known to be missing from menus:
-known_missing = {
-    '161003-third.txt': (0,),
-    '161108-third.txt': (0,),
-    '161115-third.txt': (0,),
-    '161122-third.txt': (0,),
-    '160329-first.txt': (0,),
-    '160329-third.txt': (0,),
-    '170607-combined.txt': (0, 1),
-    '170821-combined.txt': tuple(range(5)),
-    '180103-combined.txt': (0, 1),
-    # List of tuples: missing days, [(first floor), (third floor)]
-    '180122-combined.txt': [(), (0,)],
-    '180212-combined.txt': [(), (0,)],
-    '180403-combined.txt': [(0,), (0, 1)],
-    '180514-combined.txt': [(3, 4), ()],
-    '180522-combined.txt': [(0,), (0, 1)],
-    '180604-combined.txt': [(0, 1), ()],
-    '180611-combined.txt': [(), (0, 1)],
-    '180622-combined.txt': (0, 1, 2, 3),
-    '180813-combined.txt': (0, 1, 2),
-    '180827-combined.txt': (0,),
-    '181210-combined.txt': (0,),
-    '181217-combined.txt': (0, 1, 2, 3),
-    '190102-combined.txt': (0, 1),
-    '190211-combined.txt': (0, 1),
-    '190218-combined.txt': (0,),
-}
-
-date_override = {
-    '180503-dailycomb.txt': (2018, 5, 4),
-}
+# The historical posts, with what is known about each in its metadata:
+#   week: (year, week) of a menu posted in a different week
+#   date: (year, month, day) of a daily menu posted on another day
+#   missing: weekdays known to be missing from the menu
+#   missing_by_floor: weekdays known to be missing, for each floor
+ARCHIVE = PostArchive(os.path.join(here, 'historical.posts'))
+
+
+def get_file(name):
+    return ARCHIVE.message(name)
 
 
 @lru_cache(256)
-def get_file(path):
+def read_file(path):
     with io.open(path, encoding="utf8") as f:
         return f.read()
 
 
+def _known_missing(name):
+    meta = ARCHIVE[name].meta
+    if 'missing_by_floor' in meta:
+        return [tuple(days) for days in meta['missing_by_floor']]
+    if 'missing' in meta:
+        return tuple(meta['missing'])
+    return None
+
+
 def _historical():
-    dirname = os.path.join(here, 'historical')
-    filenames = glob.glob(os.path.join(dirname, "*.txt"))
-    return (fn for fn in filenames)
+    return (entry.name for entry in ARCHIVE)
 
 HISTORICAL = tuple(sorted(_historical()))
 
@@ -119,25 +96,22 @@ def _weeks():
 
 
 
-@lru_cache(256)
-def _extract_year_weeknum(path):
-    filename = os.path.basename(path)
-    if filename in weeknum_override:
-        return weeknum_override[filename]
-    filename = os.path.splitext(filename)[0]
-    d = datetime.strptime(filename.split('-')[0], '%y%m%d')
+def _extract_year_weeknum(name):
+    meta = ARCHIVE[name].meta
+    if 'week' in meta:
+        return tuple(meta['week'])
+    d = datetime.strptime(name.split('-')[0], '%y%m%d')
     return d.isocalendar()[:2]
 
 
-def _extract_week_num(path):
-    return _extract_year_weeknum(path)[1]
+def _extract_week_num(name):
+    return _extract_year_weeknum(name)[1]
 
-def _extract_date(path):
-    filename = os.path.basename(path)
-    if filename in date_override:
-        return datetime(*date_override[filename], tzinfo=timezone('Europe/Oslo'))
-    filename = os.path.splitext(filename)[0]
-    d = datetime.strptime(filename.split('-')[0], '%y%m%d')
+def _extract_date(name):
+    meta = ARCHIVE[name].meta
+    if 'date' in meta:
+        return datetime(*meta['date'], tzinfo=timezone('Europe/Oslo'))
+    d = datetime.strptime(name.split('-')[0], '%y%m%d')
     return d.replace(tzinfo=timezone('Europe/Oslo'))
 
 
@@ -145,10 +119,32 @@ WEEKS = _weeks()
 
 @pytest.fixture(params=_historical_weekly())
 def historical_weekly(request):
-    path = request.param
-    filename = os.path.basename(path)
-    missing = known_missing.get(filename)
-    return get_file(path), missing
+    name = request.param
+    return get_file(name), _known_missing(name)
+
+
+@pytest.fixture
+def http_server():
+    """Start a local server for a request handler class, returning its URL"""
+    servers = []
+
+    def serve(handler):
+        server = HTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return 'http://127.0.0.1:%d' % server.server_address[1]
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(params=sorted(CORPUS))
+def fuzz_message(request):
+    return CORPUS[request.param]
 
 
 @pytest.fixture(params=_first_floor())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""The fuzz corpus of hostile posts, by name
+
+It is generated from a fixed seed as the tests import it, or written to
+tests/fuzz by running this module, to try the posts by hand.
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import random
+
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+KEYWORDS = (
+    'Meny', 'uke', 'week', 'TRANSIT', 'Expedisjonen', '1.etg', '3.etg',
+    'Mandag', 'Tuesday', 'ONSDAG', 'Thursday', 'fredag', ':', '-', '.',
+)
+
+
+def _pdf_like(rng, size):
+    """Something like a pasted PDF: digits, keywords and noise, few newlines"""
+    chunks = []
+    length = 0
+    while length < size:
+        r = rng.random()
+        if r < 0.4:
+            chunk = str(rng.randint(0, 10 ** rng.randint(1, 8)))
+        elif r < 0.7:
+            chunk = rng.choice(KEYWORDS)
+        elif r < 0.98:
+            chunk = ''.join(rng.choice('abcdefghij .,;()/') for _ in range(rng.randint(1, 12)))
+        else:
+            chunk = '\n'
+        chunks.append(chunk + ' ')
+        length += len(chunk) + 1
+    return ''.join(chunks)
+
+
+CORPUS = {
+    'digits': 'Meny uke 1 ' + '1 2 3 4 5 6 7 8 9 ' * 2000,
+    'numbered-lines': 'Meny uke 12\n' + '123 etx 1. et\n' * 3000,
+    'floor-headers': 'Meny uke 3\n' + 'TRANSIT\n' * 2000 + 'x' * 5000,
+    'whitespace': 'Meny uke 5' + ' ' * 20000 + '\n' * 5000 + ' \t' * 5000,
+    'weekdays': 'MANDAG TIRSDAG ' * 2000 + '\n' + 'onsdag\n' * 3000,
+    'headers': 'Meny uke 1 uke 2 week 3 ' * 2000,
+    'daily-headers': 'Meny mandag 11 ' * 2000 + '\n' + 'Meny 1 1 1 1 ' * 2000,
+    'header-lines': 'Meny uke 1 - 2 etg\n' * 3000,
+    'floor-sections': 'Meny uke 1\nTRANSIT\n' * 3000,
+    'long-line': 'Meny ' * 8000 + 'uke ' * 4000,
+    'pdf': _pdf_like(random.Random(1), 60000),
+}
+
+
+if __name__ == '__main__':
+    dirname = os.path.join(here, 'fuzz')
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    for name, message in sorted(CORPUS.items()):
+        path = os.path.join(dirname, name + '.txt')
+        with io.open(path, mode='wt', encoding='utf-8', newline='') as f:
+            f.write(message)
+        print('Wrote %d characters to %s' % (len(message), path))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the compact archive of posts"""
+
+import io
+import json
+
+from lunchbot.archive import PostArchive, archived_posts, import_posts, write_archive
+from lunchbot.backfill import read_post, scan_posts
+
+
+def test_write_and_read(tmpdir):
+    path = str(tmpdir.join('posts'))
+    posts = [
+        ('190211-first.txt', '2019-02-11T00:00:00+0100', 'Meny uke 7\nMandag: Blåskjell', {'week': [2019, 7]}),
+        ('190212-third.txt', '2019-02-12T00:00:00+0100', 'Meny uke 7', None),
+    ]
+    assert write_archive(path, posts) == 2
+    with PostArchive(path) as archive:
+        assert [entry.name for entry in archive] == ['190211-first.txt', '190212-third.txt']
+        assert archive.message('190211-first.txt') == 'Meny uke 7\nMandag: Blåskjell'
+        assert archive['190211-first.txt'].meta == {'week': [2019, 7]}
+        assert archive.post('190212-third.txt') == dict(
+            message='Meny uke 7', created_time='2019-02-12T00:00:00+0100'
+        )
+    assert archived_posts(path) == [post[:3] + (post[3] or {},) for post in posts]
+
+
+def test_import(tmpdir):
+    source = tmpdir.mkdir('historical')
+    source.join('160108-first.txt').write_text('Meny uke 1', encoding='utf8')
+    source.join('160111-third.txt').write_text('Meny uke 2', encoding='utf8')
+    path = str(tmpdir.join('posts'))
+    assert import_posts(str(source), path, {'160108-first.txt': {'week': [2016, 2]}}) == 2
+
+    # The days and posts are the same as from the directory:
+    assert [(day, read_post(s)) for day, s in scan_posts(path)] == [
+        (day, read_post(s)) for day, s in scan_posts(str(source))
+    ]
+
+    # And from a file of JSON lines, named by post id:
+    lines = str(tmpdir.join('posts.jsonl'))
+    with io.open(lines, 'w', encoding='utf8') as f:
+        f.write(json.dumps(dict(id='1_2', created_time='2016-01-11T10:00:00+0000', message='Hei')) + '\n')
+    assert import_posts(lines, path) == 1
+    with PostArchive(path) as archive:
+        assert archive.message('1_2') == 'Hei'
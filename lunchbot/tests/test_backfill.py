@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test backfilling menus for a range of dates"""
+
+import datetime
+import io
+import json
+import os
+
+from lunchbot.backfill import TIMEZONE, backfill, read_post, scan_posts
+from lunchbot.main import PostIndex, get_menus
+
+
+here = os.path.abspath(os.path.dirname(__file__))
+historical = os.path.join(here, 'historical.posts')
+
+
+def test_backfill_matches_get_menus(tmpdir):
+    start, end = datetime.date(2018, 4, 30), datetime.date(2018, 6, 10)
+    # Write some of the archive as JSON lines:
+    path = str(tmpdir.join('posts.jsonl'))
+    with io.open(path, 'w', encoding='utf8') as f:
+        for day, source in scan_posts(historical):
+            if datetime.date(2018, 1, 1) <= day < datetime.date(2019, 1, 1):
+                f.write(json.dumps(read_post(source)) + '\n')
+
+    output = io.StringIO()
+    backfill(path, start, end, output, workers=2)
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(records) == 30
+
+    index = PostIndex(read_post(source) for _, source in scan_posts(historical))
+    for record in records:
+        day = datetime.datetime.strptime(record.pop('date'), '%Y-%m-%d')
+        date = TIMEZONE.localize(day.replace(hour=12))
+        assert record == get_menus(None, date, index=index)._asdict()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the on-disk parse cache"""
+
+from lunchbot.cache import ParseCache, MISSING
+from lunchbot.main import parse_post, parser_version, Menu
+
+
+def test_parse_post_cached(tmpdir, historical_daily_post):
+    _, post = historical_daily_post
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = ParseCache(path, parser_version())
+    parsed = parse_post(post, cache)
+    assert len(cache) == 1
+    cache.close()
+
+    cache = ParseCache(path, parser_version())
+    assert cache.get(post['message']) is not MISSING
+    cached = parse_post(post, cache)
+    assert cached == parsed
+    assert isinstance(cached.menus[0], Menu)
+    cache.close()
+
+
+def test_not_a_menu_cached(tmpdir):
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')), parser_version())
+    post = dict(message='Velkommen til julebord!', created_time='2018-12-01T12:00:00+0000')
+    assert parse_post(post, cache) is None
+    assert cache.get(post['message']) is None
+
+
+def test_version_change_invalidates(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = ParseCache(path, 'old')
+    cache.put('message', [1, 2])
+    cache.close()
+
+    cache = ParseCache(path, 'new')
+    assert len(cache) == 0
+    assert cache.get('message') is MISSING
+
+
+def test_eviction(tmpdir):
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')), 'v', max_entries=3)
+    for i in range(5):
+        cache.put('message %d' % i, i)
+    cache.evict()
+    assert len(cache) == 3
+
+    cache.max_age = -1
+    cache.evict()
+    assert len(cache) == 0
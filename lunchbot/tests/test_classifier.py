@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test classifying posts by the kind of menu in them"""
+
+import pytest
+
+from lunchbot.classifier import (
+    classify, may_be_menu, BY_DAY_FIRST, DAILY_COMBINED, NOT_A_MENU, WEEKLY_COMBINED, WEEKLY_SINGLE_FLOOR,
+)
+from lunchbot.ingest import classify as archive_kind
+
+
+@pytest.mark.parametrize('message, kind, floors', [
+    ('Meny uke 7\nTRANSIT 1.etg\nMandag: Fisk\nEXPEDITION 3.etg\nMandag: Suppe', WEEKLY_COMBINED, ('first', 'third')),
+    ('Meny uke 7\nEXPEDITION 3.etg\nMandag: Suppe\nTRANSIT 1.etg\nMandag: Fisk', WEEKLY_COMBINED, ('third', 'first')),
+    ('Meny Transit uke 7\nTRANSIT 1.etg\nMandag: Fisk\nTirsdag: Taco', WEEKLY_SINGLE_FLOOR, ('first',)),
+    ('Meny 12. februar\nTRANSIT\nFisk\nEXPEDITION\nSuppe', DAILY_COMBINED, ('first', 'third')),
+    ('Meny uke 7\nMandag: Fisk\nTirsdag: Suppe', BY_DAY_FIRST, ()),
+    ('Meny 12. februar\nTRANSIT\nFisk', NOT_A_MENU, ('first',)),
+    ('Velkommen til fredagsbar i kantina!', NOT_A_MENU, ()),
+    ('Ny meny i kantina fra mandag', NOT_A_MENU, ()),
+])
+def test_classify(message, kind, floors):
+    classified = classify(message)
+    assert classified.kind == kind
+    assert classified.floors == floors
+
+
+def test_rejects_without_keywords():
+    assert not may_be_menu('Velkommen til fredagsbar!')
+    assert may_be_menu('MENY UKE 7')
+    assert may_be_menu('Menyer for uke 7')
+    assert not may_be_menu('Husk å bruke kortet i kantina, kaffen er trukket fra 3. etg')
+    assert classify('Velkommen til fredagsbar!').segments is None
+
+
+def test_archive_kinds():
+    assert archive_kind('Meny uke 7\nEXPEDITION 3.etg\nMandag: Suppe') == 'third'
+    assert archive_kind('Meny uke 7\nMandag: Fisk\nTirsdag: Suppe') == 'byday'
+    assert archive_kind('Velkommen') is None
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test scheduling in daemon mode"""
+
+import datetime
+
+from lunchbot.daemon import TIMEZONE, group_by_time, next_slot
+
+
+def test_group_by_time():
+    schedule = group_by_time({'a': '11:00', 'b': '10:30', 'c': '11:00'})
+    assert list(schedule.items()) == [
+        (datetime.time(10, 30), ['b']),
+        (datetime.time(11, 0), ['a', 'c']),
+    ]
+
+
+def test_next_slot_same_day():
+    schedule = group_by_time({'a': '11:00', 'b': '10:30'})
+    # A Monday:
+    now = TIMEZONE.localize(datetime.datetime(2019, 2, 25, 10, 45))
+    slot, channels = next_slot(schedule, now)
+    assert slot == TIMEZONE.localize(datetime.datetime(2019, 2, 25, 11, 0))
+    assert channels == ['a']
+
+
+def test_next_slot_skips_weekend():
+    schedule = group_by_time({'a': '10:30'})
+    # A Friday, after posting:
+    now = TIMEZONE.localize(datetime.datetime(2019, 3, 1, 12, 0))
+    slot, channels = next_slot(schedule, now)
+    assert slot == TIMEZONE.localize(datetime.datetime(2019, 3, 4, 10, 30))
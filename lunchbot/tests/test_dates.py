@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the names of months and weekdays"""
+
+from lunchbot.dates import month_number, weekday_number
+from lunchbot.segmenter import Header, _match_header
+
+
+def test_names():
+    assert month_number('februar') == month_number('February') == 2
+    assert month_number('Mai.') == month_number('may') == 5
+    assert month_number('etg') is None
+    assert weekday_number('ONSDAG') == weekday_number('Wendsday') == 2
+    assert weekday_number('lørdag') == 5
+    assert weekday_number(None) is None
+
+
+def test_daily_headers():
+    assert _match_header('Meny mandag 11. februar:') == Header('daily', None, 0, 11, 2)
+    assert _match_header('Menu Wednesday 6th March') == Header('daily', None, 2, 6, 3)
+    # Not a month, so not a daily menu:
+    assert _match_header('Meny 3 etasjer') is None
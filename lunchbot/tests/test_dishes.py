@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the dish index"""
+
+import datetime
+
+from lunchbot.dishes import DishIndex, menu_dishes
+from lunchbot.main import Menu
+
+
+MONDAY = datetime.date(2019, 2, 11)
+TUESDAY = datetime.date(2019, 2, 12)
+
+
+def test_menu_dishes():
+    menu = Menu(first='Taco\n\n- Fiskegrateng', third='Suppe')
+    assert [(d.floor, d.text, d.weekday) for d in menu_dishes(MONDAY, menu)] == [
+        ('first', 'Taco', 0),
+        ('first', 'Fiskegrateng', 0),
+        ('third', 'Suppe', 0),
+    ]
+
+
+def test_search(tmpdir):
+    path = str(tmpdir.join('dishes.sqlite'))
+    index = DishIndex(path)
+    index.add_menu(MONDAY, Menu(first='Tacos med salsa', third='Fish casserole'))
+    index.add_menu(TUESDAY, Menu(combined='Taco\nBaked fish casserole'))
+    index.close()
+
+    index = DishIndex(path)
+    assert [(d.date, d.floor) for d in index.search('taco')] == [(TUESDAY, 'combined'), (MONDAY, 'first')]
+    assert [d.date for d in index.search('FISH casserole', floor='third')] == [TUESDAY, MONDAY]
+    assert [d.floor for d in index.search('taco', floor='third')] == ['combined']
+    assert index.search('pizza') == []
+
+    # Adding a date again replaces its dishes:
+    index.add_menu(TUESDAY, Menu(combined='Pizza'))
+    assert [d.date for d in index.search('taco')] == [MONDAY]
+    assert len(index) == 3
+    index.close()
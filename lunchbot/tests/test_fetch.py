@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test fetching through the response cache, against a local server"""
+
+try:
+    from http.server import BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from lunchbot.fetch import Fetcher, ResponseCache
+
+
+BODY = b'Meny uke 3'
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_url(http_server):
+    PageHandler.requests = []
+    return http_server(PageHandler) + '/page/posts'
+
+
+def parser(calls):
+    def parse(r):
+        calls.append(r.url)
+        return r.text.split()
+    return parse
+
+
+def test_fresh_entry_skips_request(tmpdir, page_url):
+    calls = []
+    fetcher = Fetcher(cache=ResponseCache(str(tmpdir.join('responses.sqlite'))), ttl=60)
+    assert fetcher.get(page_url, parser(calls), 'words') == ['Meny', 'uke', '3']
+    assert fetcher.get(page_url, parser(calls), 'words') == ['Meny', 'uke', '3']
+    assert len(PageHandler.requests) == 1
+    assert len(calls) == 1
+    fetcher.close()
+
+
+def test_not_modified_skips_parsing(tmpdir, page_url):
+    calls = []
+    path = str(tmpdir.join('responses.sqlite'))
+    fetcher = Fetcher(cache=ResponseCache(path), ttl=0)
+    assert fetcher.get(page_url, parser(calls), 'words') == ['Meny', 'uke', '3']
+    fetcher.close()
+
+    # A new run revalidates, and gets the parsed value back on a 304:
+    fetcher = Fetcher(cache=ResponseCache(path), ttl=0)
+    assert fetcher.get(page_url, parser(calls), 'words') == ['Meny', 'uke', '3']
+    assert len(PageHandler.requests) == 2
+    assert PageHandler.requests[1]['If-None-Match'] == '"v1"'
+    assert len(calls) == 1
+    fetcher.close()
+
+
+def test_values_of_other_parsers_not_used(tmpdir, page_url):
+    calls = []
+    path = str(tmpdir.join('responses.sqlite'))
+    fetcher = Fetcher(cache=ResponseCache(path), ttl=0)
+    assert fetcher.get(page_url, parser(calls), 'words') == ['Meny', 'uke', '3']
+    # Not revalidated, but fetched and parsed again for another parser:
+    assert fetcher.get(page_url, lambda r: r.text, 'text') == 'Meny uke 3'
+    assert 'If-None-Match' not in PageHandler.requests[1]
+    assert fetcher.get(page_url, parser(calls), 'words') == ['Meny', 'uke', '3']
+    assert len(calls) == 1
+    fetcher.close()
+
+
+def test_error_not_cached(tmpdir, http_server):
+    fetcher = Fetcher(cache=ResponseCache(str(tmpdir.join('responses.sqlite'))))
+    # The base handler answers 501 Not Implemented:
+    url = http_server(BaseHTTPRequestHandler) + '/missing'
+    with pytest.raises(requests.HTTPError):
+        fetcher.get(url, parser([]), 'words')
+    assert fetcher.cache.get(url, 'words') is None
+    fetcher.close()
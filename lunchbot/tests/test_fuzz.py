@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Check that hostile posts are parsed in bounded time"""
+
+import time
+
+import pytest
+
+from lunchbot.main import (
+    is_matching_message,
+    extract_menu,
+    patterns_first_floor,
+    patterns_third_floor,
+    patterns_combined,
+    patterns_daily_combined,
+)
+from lunchbot.segmenter import segment, ParseTimeout
+from lunchbot.tests.make_fuzz import CORPUS
+
+# Generous, so that slow CI machines pass. The slowest post in the corpus
+# takes well under a second on a laptop.
+MAX_SECONDS = 5
+
+
+def test_fuzz_bounded(fuzz_message):
+    start = time.perf_counter()
+    segment(fuzz_message)
+    extract_menu(fuzz_message)
+    for patterns in (
+        patterns_first_floor,
+        patterns_third_floor,
+        patterns_combined,
+        patterns_daily_combined,
+    ):
+        is_matching_message(fuzz_message, patterns, 1, budget=0)
+    assert time.perf_counter() - start < MAX_SECONDS
+
+
+def test_budget_exceeded():
+    with pytest.raises(ParseTimeout):
+        segment(CORPUS['numbered-lines'], 1e-6)
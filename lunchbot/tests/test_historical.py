@@ -15,6 +15,7 @@ from lunchbot.main import (
     patterns_combined,
     patterns_daily_combined,
 )
+from lunchbot.segmenter import segment
 
 pattern_daynames = re.compile(r'MANDAG|TIRSDAG|ONSDAG|TORSDAG|FREDAG|MONDAY|TUESDAY|WEDNESDAY|THURSDAY|FRIDAY')
 
@@ -61,6 +62,12 @@ def test_combined_match(historical_combined):
     week_num, message = historical_combined
     assert is_matching_message(message, patterns_combined, week_num)
 
+def test_combined_segments(historical_combined):
+    week_num, message = historical_combined
+    segments = segment(message)
+    assert segments.header.weeknum == week_num
+    assert set(segments.floors) == {'first', 'third'}
+
 def test_daily_sanity(historical_daily_post):
     date, post = historical_daily_post
     menu = get_menus_for_day({'data': [post]}, date)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test looking up menus in an index of posts"""
+
+from datetime import datetime
+
+from pytz import timezone
+
+from lunchbot.main import Menu, PostIndex, get_menus
+
+
+OSLO = timezone('Europe/Oslo')
+
+
+def weekly_post(weeknum, created, dish):
+    message = 'Meny uke %d\nMandag: %s\nTirsdag: Suppe\nOnsdag: Pasta\nTorsdag: Taco\nFredag: Pizza' % (
+        weeknum, dish)
+    return dict(message=message, created_time=created)
+
+
+def test_picks_matching_week():
+    posts = [
+        # Newest first, as on the page:
+        weekly_post(8, '2019-02-18T08:00:00+0000', 'Laks'),
+        weekly_post(7, '2019-02-11T08:00:00+0000', 'Torsk'),
+    ]
+    index = PostIndex(posts)
+    assert len(index) == 2
+    menu = get_menus(posts, OSLO.localize(datetime(2019, 2, 11, 10)), index=index)
+    assert 'Torsk' in menu.combined
+    menu = get_menus(posts, OSLO.localize(datetime(2019, 2, 18, 10)), index=index)
+    assert 'Laks' in menu.combined
+
+
+def test_window():
+    posts = [weekly_post(1, '2019-01-01T08:00:00+0000', 'Laks')]
+    index = PostIndex(posts)
+    assert index.window(OSLO.localize(datetime(2019, 1, 14, 10)), 14) == (0, 1)
+    assert index.window(OSLO.localize(datetime(2019, 1, 16, 10)), 14) == (1, 1)
+    assert get_menus(posts, OSLO.localize(datetime(2019, 1, 16, 10)), index=index).combined is None
+
+
+def test_no_menu_from_another_week():
+    posts = [weekly_post(7, '2019-02-11T08:00:00+0000', 'Torsk')]
+    assert get_menus(posts, OSLO.localize(datetime(2019, 2, 18, 10))) == Menu()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test ingesting posts into the archive"""
+
+import io
+import json
+
+from lunchbot.archive import PostArchive
+from lunchbot.ingest import ingest, read_watermark
+
+
+MENU = 'Meny uke 7\nTRANSIT 1.etg\nMandag: Fisk\nEXPEDITION 3.etg\nMandag: Suppe'
+
+
+class FakeGraph(object):
+    """Pages of posts, newest first, counting the pages read"""
+
+    def __init__(self, posts, page_size=2):
+        self.posts = posts
+        self.page_size = page_size
+        self.pages_read = 0
+
+    def get(self, path, page=False, fields=None, limit=None):
+        assert page and fields == 'message,created_time'
+        for i in range(0, len(self.posts), self.page_size):
+            self.pages_read += 1
+            yield dict(data=self.posts[i:i + self.page_size])
+
+
+def post(i, message='Velkommen'):
+    return dict(id='page_%d' % i, created_time='2019-02-%02dT08:00:00+0000' % i, message=message)
+
+
+def test_ingest_stops_at_watermark(tmpdir):
+    path = str(tmpdir.join('posts'))
+    graph = FakeGraph([post(4, MENU), post(3), dict(id='page_2', created_time='2019-02-02T08:00:00+0000')])
+    assert ingest(graph, 'page', path) == 2
+    assert read_watermark(path)[1] == 'page_4'
+
+    graph = FakeGraph([post(9), post(8), post(7), post(6), post(5), post(4, MENU), post(3), post(2), post(1)])
+    assert ingest(graph, 'page', path) == 5
+    assert graph.pages_read == 3
+
+    with PostArchive(path) as archive:
+        assert [entry.name for entry in archive] == ['page_%d' % i for i in (3, 4, 5, 6, 7, 8, 9)]
+        assert [entry.meta for entry in archive.entries[:2]] == [{}, {'kind': 'combined'}]
+        assert archive.message('page_4') == MENU
+
+
+def test_ingest_converts_json_lines(tmpdir):
+    path = str(tmpdir.join('posts.jsonl'))
+    with io.open(path, 'w', encoding='utf8') as f:
+        f.write(json.dumps(dict(post(3, MENU), kind='combined')) + '\n')
+    assert ingest(FakeGraph([post(4), post(3, MENU)]), 'page', path) == 1
+    with PostArchive(path) as archive:
+        assert [(entry.name, entry.meta) for entry in archive] == [
+            ('page_3', {'kind': 'combined'}), ('page_4', {}),
+        ]
+
+
+def test_ingest_imports_old_default(tmpdir):
+    path = str(tmpdir.join('posts'))
+    with io.open(path + '.jsonl', 'w', encoding='utf8') as f:
+        f.write(json.dumps(post(3, MENU)) + '\n')
+    assert ingest(FakeGraph([post(4), post(3, MENU)]), 'page', path) == 1
+    with PostArchive(path) as archive:
+        assert [entry.name for entry in archive] == ['page_3', 'page_4']
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test finding weekdays, misspelled or not"""
+
+import re
+
+import pytest
+
+from lunchbot.keywords import keyword_pattern, misspellings, within_one_typo
+from lunchbot.segmenter import day_of, find_days, split_days
+
+
+@pytest.mark.parametrize('word, keyword, expected', [
+    ('onsdag', 'onsdag', True),
+    ('tisdag', 'tirsdag', True),
+    ('tirsdga', 'tirsdag', True),
+    ('freadag', 'fredag', True),
+    ('thursdy', 'thursday', True),
+    ('fresag', 'fredag', True),
+    ('fedrga', 'fredag', False),
+    ('mandag', 'fredag', False),
+    ('tirs', 'tirsdag', False),
+])
+def test_within_one_typo(word, keyword, expected):
+    assert within_one_typo(word, keyword) == expected
+
+
+def test_misspellings_are_within_one_typo():
+    for spelling in misspellings('onsdag'):
+        word = ''.join(letter or 'x' for letter in spelling)
+        assert within_one_typo(word, 'onsdag')
+
+
+def test_pattern_prefers_keywords():
+    pattern = re.compile(keyword_pattern(['fredag', 'friday']), re.IGNORECASE)
+    assert [m.group() for m in pattern.finditer('Fredagsmeny, FRIDAY, Freadag, Frida, ufredag')] == [
+        'Fredag', 'FRIDAY', 'Freadag', 'fredag',
+    ]
+
+
+@pytest.mark.parametrize('word, day', [
+    ('Mandag', 0), ('Tisdag', 1), ('Ondsag', 2), ('wendsday', 2), ('Wednesay', 2), ('Thursdy', 3), ('Firday', 4),
+    # As close to lørdag and søndag as to a weekday:
+    ('sandag', None),
+])
+def test_day_of(word, day):
+    assert day_of(word) == day
+
+
+def test_misspellings_are_whole_words():
+    pattern = re.compile(keyword_pattern(['mandag', 'tirsdag']), re.IGNORECASE)
+    assert [m.group() for m in pattern.finditer('Mandatory meeting, Mandga: Taco, Tisdagsmeny')] == ['Mandga']
+
+
+def test_finds_every_day_in_one_pass():
+    text = 'Mandag: Fisk\nTisdag: Taco\nOnsdga: Pasta\nThursdy: Suppe\nFredag: Pizza\nSøndag: Stengt'
+    assert [day for _, day in find_days(text)] == [0, 1, 2, 3, 4]
+    assert split_days(text) == ['Fisk', 'Taco', 'Pasta', 'Suppe', 'Pizza\nSøndag: Stengt']
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the metrics of a run"""
+
+from lunchbot.main import parse_post
+from lunchbot.metrics import METRICS, Metrics
+
+
+def test_render(tmpdir):
+    metrics = Metrics()
+    metrics.inc('lunchbot_posts_scanned_total', 12, site='technopolis')
+    metrics.set('lunchbot_last_run_success', 1)
+    with metrics.timer('fetch', site='technopolis'):
+        pass
+    metrics.observe('lunchbot_slack_call_seconds', 0.3)
+    metrics.observe('lunchbot_slack_call_seconds', 3)
+
+    path = tmpdir.join('lunchbot.prom')
+    metrics.write(str(path))
+    lines = path.read().splitlines()
+    assert 'lunchbot_posts_scanned_total{site="technopolis"} 12.0' in lines
+    assert 'lunchbot_last_run_success 1.0' in lines
+    assert '# TYPE lunchbot_stage_seconds histogram' in lines
+    assert 'lunchbot_stage_seconds_count{site="technopolis",stage="fetch"} 1' in lines
+    assert 'lunchbot_slack_call_seconds_bucket{le="0.25"} 0' in lines
+    assert 'lunchbot_slack_call_seconds_bucket{le="0.5"} 1' in lines
+    assert 'lunchbot_slack_call_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'lunchbot_slack_call_seconds_sum 3.3' in lines
+
+
+def test_patterns_tried():
+    key = ('lunchbot_patterns_tried_total', (('result', 'hit'), ('variant', 'segment:weekly by day')))
+    before = METRICS.counters[key]
+    parse_post(dict(message='Meny uke 7\nMandag: Fisk\nFredag: Pizza', created_time='2019-02-11T08:00:00+0000'))
+    assert METRICS.counters[key] == before + 1
+    assert 'lunchbot_patterns_tried_total{result="hit",variant="segment:weekly by day"}' in METRICS.render()
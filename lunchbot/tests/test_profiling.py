@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test profiling of runs and patterns"""
+
+import pstats
+import re
+import threading
+
+from lunchbot.profiling import PatternProfile, TimedPattern, run_profiled
+
+
+def test_timed_pattern():
+    profile = PatternProfile()
+    pattern = TimedPattern(re.compile(r'uke (?P<weeknum>\d+)', re.IGNORECASE), 'week', profile)
+    assert pattern.search('Meny Uke 7').group('weeknum') == '7'
+    assert [m.group(0) for m in pattern.finditer('uke 1, uke 2')] == ['uke 1', 'uke 2']
+    assert pattern.flags & re.IGNORECASE
+    calls, seconds, slowest, text = profile.timings['week']
+    assert calls == 2
+    assert 0 <= slowest <= seconds
+    assert text in ('Meny Uke 7', 'uke 1, uke 2')
+
+
+def in_thread():
+    return sum(range(1000))
+
+
+def test_profile_threads(tmpdir):
+    def run():
+        thread = threading.Thread(target=in_thread)
+        thread.start()
+        thread.join()
+        return 'done'
+
+    path = str(tmpdir.join('run.prof'))
+    assert run_profiled(path, run) == 'done'
+    functions = [name for _, _, name in pstats.Stats(path).stats]
+    assert 'run' in functions
+    assert 'in_thread' in functions
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Check that the replay benchmark runs, and compares to a baseline"""
+
+from lunchbot.tests.bench_replay import STAGES, compare, load_weeks, measure
+
+
+def test_replay_some_weeks():
+    weeks = load_weeks()[:4]
+    result = measure(weeks, runs=1)
+    assert result['weeks'] == 4
+    assert result['posts'] == sum(len(posts) for _, posts in weeks)
+    assert set(result['stages']) == set(STAGES)
+    assert compare(result, result) == []
+
+    slower = dict(result, posts_per_second=result['posts_per_second'] / 2)
+    assert compare(slower, result) == ['posts/s']
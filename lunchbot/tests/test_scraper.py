@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the streaming scraper of facebook pages"""
+
+from datetime import datetime, timedelta
+
+from pytz import utc
+
+from lunchbot.scraper import iter_posts
+
+
+START = datetime(2019, 1, 14, 9, 0, tzinfo=utc)
+
+POST = (
+    '<div class="_5pcr userContentWrapper">'
+    '<div><abbr data-utime="{utime}" title="x"><span class="timestampContent">1 t</span></abbr></div>'
+    '<div class="_5pbx userContent"><p>Meny uke {week}<br />Mandag: fisk &amp; potet'
+    '<span class="text_exposed_hide">...</span><span class="text_exposed_show"> med saus</span></p>'
+    '</div><div class="comments">Not part of the post</div></div>'
+)
+
+
+def page(count):
+    posts = ''.join(
+        POST.format(utime=int((START - timedelta(days=7 * i)).timestamp()), week=3 - i)
+        for i in range(count)
+    )
+    return '<html><body><script>var s = "<div>";</script>' + posts + '</body></html>'
+
+
+def chunked(text, size):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def test_posts_from_chunks():
+    html = page(3)
+    whole = list(iter_posts([html]))
+    assert len(whole) == 3
+    assert whole[0] == {
+        'created_time': START.isoformat(),
+        'message': 'Meny uke 3 \nMandag: fisk & potet med saus',
+    }
+    for size in (1, 5, 64):
+        assert list(iter_posts(chunked(html, size))) == whole
+
+
+def test_stops_after_oldest():
+    consumed = []
+
+    def chunks():
+        for chunk in chunked(page(10), 100):
+            consumed.append(chunk)
+            yield chunk
+
+    posts = list(iter_posts(chunks(), oldest=START - timedelta(days=10)))
+    # Two posts, then two stale ones before stopping:
+    assert len(posts) == 4
+    assert len(consumed) < len(list(chunked(page(10), 100)))
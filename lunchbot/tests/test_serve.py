@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test serving the menus over HTTP, from posts indexed up front"""
+
+import datetime
+import json
+import os
+import threading
+import time
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, HTTPError
+
+import pytest
+
+from lunchbot.archive import PostArchive
+from lunchbot.config import Site
+from lunchbot.main import PostIndex, get_menus
+from lunchbot.serve import MenuService, handler_for, noon
+
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+SITE = Site('technopolis', 'technopolisitfornebu', ['lunch'], None)
+
+# A Wednesday:
+TODAY = datetime.date(2019, 2, 13)
+
+
+def load(site, date):
+    with PostArchive(os.path.join(here, 'historical.posts')) as archive:
+        posts = [archive.post(entry) for entry in reversed(archive.entries) if entry.name.startswith('1902')]
+    return PostIndex(posts)
+
+
+@pytest.fixture
+def service():
+    service = MenuService(load, [SITE])
+    service.now = lambda: noon(TODAY)
+    return service
+
+
+def get(url):
+    try:
+        response = urlopen(url)
+    except HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf8'))
+    return response.getcode(), json.loads(response.read().decode('utf8'))
+
+
+def test_not_ready_before_refresh(service, http_server):
+    url = http_server(handler_for(service))
+    assert get(url + '/menu/today')[0] == 503
+
+
+def test_menus(service, http_server):
+    service.refresh()
+    url = http_server(handler_for(service))
+    index = load(SITE, None)
+
+    status, data = get(url + '/menu/today')
+    assert status == 200
+    assert data['date'] == '2019-02-13'
+    expected = get_menus(None, noon(TODAY), index=index)
+    assert expected.first
+    assert data['menu']['first'] == expected.first
+    assert get(url + '/menu/2019-02-13')[1] == data
+
+    status, data = get(url + '/menu/week/7')
+    assert status == 200
+    assert [day['date'] for day in data['days']] == [
+        '2019-02-11', '2019-02-12', '2019-02-13', '2019-02-14', '2019-02-15',
+    ]
+    assert data['days'][2] == dict(date='2019-02-13', menu=get(url + '/menu/today')[1]['menu'])
+
+
+@pytest.mark.parametrize('path', [
+    '/menu/2019-02-30', '/menu/2018-02-13', '/menu/week/60', '/menu/today?site=other', '/menus',
+])
+def test_not_found(service, http_server, path):
+    service.refresh()
+    url = http_server(handler_for(service))
+    assert get(url + path)[0] == 404
+
+
+def test_concurrent_misses_build_once(service):
+    calls = []
+
+    def build():
+        calls.append(1)
+        time.sleep(0.05)
+        return b'menu'
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(service.response('key', build)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b'menu'] * 8
+    assert len(calls) == 1
+
+
+def test_refresh_drops_responses(service):
+    service.refresh()
+    service.response('key', lambda: b'old')
+    service.refresh()
+    assert service.response('key', lambda: b'new') == b'new'
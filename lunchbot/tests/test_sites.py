@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test per-site floor headers, and running sites independently"""
+
+import threading
+
+import pytest
+
+from lunchbot.config import Site
+from lunchbot.main import for_each_site, parse_post
+from lunchbot.segmenter import compile_floor_headers
+
+
+MESSAGE = '''Meny uke 7
+
+Kantine Nord
+Mandag: Taco
+Tirsdag: Suppe
+
+Kantine Syd
+Mandag: Fisk
+Tirsdag: Pasta
+'''
+
+
+def test_site_floor_headers():
+    post = dict(message=MESSAGE, created_time='2019-02-11T08:00:00+0000')
+    # Not a floor-first menu with the default headers:
+    assert not parse_post(post).by_floor
+
+    headers = compile_floor_headers((('first', 'Kantine Nord'), ('third', 'Kantine Syd')))
+    parsed = parse_post(post, headers=headers)
+    assert parsed.by_floor
+    assert parsed.menus[0].first == 'Taco'
+    assert parsed.menus[0].third == 'Fisk'
+
+
+def test_failing_site_does_not_stop_others():
+    sites = [Site(name, name, [name], None) for name in ('slow', 'broken', 'fast')]
+    fast_done = threading.Event()
+
+    def run_site(site):
+        if site.name == 'broken':
+            raise ValueError('Broken page')
+        if site.name == 'slow':
+            # Only finishes if the other sites run alongside it:
+            assert fast_done.wait(5)
+        else:
+            fast_done.set()
+        return site.name
+
+    with pytest.raises(ValueError):
+        for_each_site(sites, run_site, workers=3)
+    assert fast_done.is_set()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test posting to a local fake of the Slack API"""
+
+import datetime
+import json
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import parse_qs
+
+import pytest
+
+from lunchbot import main
+from lunchbot.apiwrappers import SlackPoster
+from lunchbot.config import Site, Workspace
+from lunchbot.main import NO_MENU, Menu, message_kind, post_menus, run_site, site_targets
+from lunchbot.outbox import Outbox, QueuedPoster
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    posted = []
+    # Channels to rate limit on their first post:
+    limited = set()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf8')
+        if 'json' in self.headers.get('Content-Type', ''):
+            args = json.loads(body)
+        else:
+            args = dict((k, v[0]) for k, v in parse_qs(body).items())
+        with self.lock:
+            if args['channel'] in self.limited:
+                self.limited.discard(args['channel'])
+                self.reply(429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': '0'})
+                return
+            self.posted.append((self.path, args['channel'], args['text']))
+        self.reply(200, {'ok': True, 'channel': args['channel'], 'ts': '1.0'})
+
+    def reply(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slack_url(http_server):
+    FakeSlackHandler.posted = []
+    FakeSlackHandler.limited = set()
+    return http_server(FakeSlackHandler) + '/api/'
+
+
+def test_one_message_per_channel(slack_url):
+    channels = ['a', 'b', 'c', 'd']
+    poster = SlackPoster('xoxb-test', channels, base_url=slack_url)
+    post_menus(Menu(first='Fisk', third='Suppe'), poster.post)
+    assert sorted(ch for _, ch, _ in FakeSlackHandler.posted) == channels
+    for path, _, text in FakeSlackHandler.posted:
+        assert path == '/api/chat.postMessage'
+        assert text == '*First floor menu:*\nFisk\n\n*Third floor menu:*\nSuppe'
+
+
+def test_retry_after_rate_limit(slack_url):
+    FakeSlackHandler.limited = set(['b'])
+    poster = SlackPoster('xoxb-test', ['a', 'b'], base_url=slack_url)
+    poster.post('Meny')
+    assert sorted(ch for _, ch, _ in FakeSlackHandler.posted) == ['a', 'b']
+
+
+def test_outbox_posts_once(slack_url, tmpdir):
+    path = str(tmpdir.join('outbox.sqlite'))
+    FakeSlackHandler.limited = set(['b'])
+    poster = SlackPoster('xoxb-test', ['a', 'b'], base_url=slack_url, max_retries=0)
+    queued = QueuedPoster(poster.post_to, ['a', 'b'], path, message_kind)
+    # Reruns post neither the menu nor the apology again:
+    for _ in range(2):
+        post_menus(Menu(), queued.post)
+        post_menus(Menu(first='Fisk'), queued.post)
+    menu = '*First floor menu:*\nFisk\n\n_Could not find a menu for the third floor today_ :disappointed:'
+    assert sorted((ch, text) for _, ch, text in FakeSlackHandler.posted) == [
+        ('a', menu), ('a', NO_MENU), ('b', menu), ('b', NO_MENU),
+    ]
+
+
+def test_outbox_gives_up(tmpdir):
+    outbox = Outbox(str(tmpdir.join('outbox.sqlite')), max_attempts=3)
+    today = datetime.date(2019, 2, 11)
+    outbox.put(today, 'a', 'menu', 'Meny')
+    waits = []
+
+    def fail(channel, text):
+        raise IOError('down')
+
+    assert isinstance(outbox.drain(fail, sleep=waits.append), IOError)
+    assert outbox.state(today, 'a', 'menu') == 'failed'
+    assert len(waits) == 2 and 0.9 < waits[0] <= 1 and 1.9 < waits[1] <= 2
+    # A rerun tries it again:
+    outbox.put(today, 'a', 'menu', 'Meny')
+    assert outbox.drain(lambda channel, text: None) is None
+    assert outbox.state(today, 'a', 'menu') == 'sent'
+    outbox.close()
+
+
+def test_outbox_posts_due_messages_concurrently(tmpdir):
+    outbox = Outbox(str(tmpdir.join('outbox.sqlite')))
+    today = datetime.date(2019, 2, 11)
+    for channel in 'abc':
+        outbox.put(today, channel, 'menu', 'Meny')
+    # Every channel is posted to at once, or the barrier times out:
+    together = threading.Barrier(3, timeout=5)
+    sent, waits = [], []
+
+    def send(channel, text):
+        if not waits:
+            together.wait()
+            if channel == 'a':
+                raise IOError('rate limited')
+        sent.append(channel)
+
+    assert outbox.drain(send, sleep=waits.append) is None
+    # The retry of one channel is only waited for once the others are sent:
+    assert sorted(sent[:2]) == ['b', 'c'] and sent[2:] == ['a']
+    assert len(waits) == 1
+    outbox.close()
+
+
+def test_fan_out_to_workspaces(slack_url, monkeypatch):
+    site = Site('technopolis', 'technopolisitfornebu', ['lunch'], None)
+    monkeypatch.setattr(main, 'OUTBOX_PATH', '')
+    monkeypatch.setattr(main, 'WORKSPACES', [
+        Workspace('default', 'xoxb-a', None, (), None),
+        Workspace('third', 'xoxb-b', ['kantine'], (), 'third'),
+        Workspace('other', 'xoxb-c', ['meny'], ('other',), None),
+    ])
+    clients = dict((name, SlackPoster(name, [], base_url=slack_url)) for name in ('default', 'third', 'other'))
+    targets = site_targets(site, clients)
+    assert [(t.name, t.floor) for t in targets] == [('default', None), ('third', 'third')]
+
+    fetched = []
+    menu = Menu(first='Fisk', third='Suppe')
+    monkeypatch.setattr(main, 'fetch_site_menu', lambda *args: fetched.append(args) or menu)
+    monkeypatch.setattr(main, 'record_menu', lambda *args: None)
+    run_site(site, datetime.datetime(2019, 2, 11, 10), None, targets)
+    # Fetched once for all workspaces:
+    assert len(fetched) == 1
+    assert sorted((ch, text) for _, ch, text in FakeSlackHandler.posted) == [
+        ('kantine', '*Third floor menu:*\nSuppe'),
+        ('lunch', '*First floor menu:*\nFisk\n\n*Third floor menu:*\nSuppe'),
+    ]
+    # A menu not split by floor goes to every workspace whole:
+    assert main.render_menu(Menu(combined='Taco'), 'third') == ["*Today's menu:*\nTaco"]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test racing the sources of posts"""
+
+import datetime
+import io
+import json
+import threading
+import time
+
+import pytest
+from pytz import timezone
+
+from lunchbot.config import Site
+from lunchbot.sources import archive_source, available_sources, first_usable
+
+
+OSLO = timezone('Europe/Oslo')
+
+
+@pytest.fixture
+def hang():
+    """An event that sources can hang on until the test is done"""
+    released = threading.Event()
+    yield released
+    released.set()
+
+
+def race(results, hang, hedge=0.05, timeout=2):
+    """Race sources that give results[name], hanging on None, raising an
+    exception, and usable unless the result is 'empty'"""
+    def fetch(name):
+        result = results[name]
+        if result is None:
+            hang.wait()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def check(name, result):
+        return (name, result), result != 'empty'
+
+    return first_usable(list(results), fetch, check, hedge, timeout)
+
+
+def test_hedges_a_hanging_source(hang):
+    start = time.monotonic()
+    assert race(dict(scraper=None, graph='posts'), hang) == ('graph', 'posts')
+    assert time.monotonic() - start < 1
+
+
+def test_starts_next_after_failure(hang):
+    start = time.monotonic()
+    results = dict(scraper=ValueError("Couldn't find posts"), graph='posts')
+    assert race(results, hang, hedge=10) == ('graph', 'posts')
+    assert time.monotonic() - start < 1
+
+
+def test_prefers_a_menu(hang):
+    assert race(dict(scraper='empty', graph='posts'), hang, hedge=10) == ('graph', 'posts')
+    assert race(dict(scraper='empty', graph=ValueError('no')), hang) == ('scraper', 'empty')
+
+
+def test_raises_first_error(hang):
+    with pytest.raises(ValueError, match='first'):
+        race(dict(scraper=ValueError('first'), graph=KeyError('second')), hang)
+
+
+def test_bounded_by_timeout(hang):
+    start = time.monotonic()
+    with pytest.raises(ValueError, match='No posts'):
+        race(dict(scraper=None, graph=None), hang, timeout=0.2)
+    assert time.monotonic() - start < 1
+
+
+def test_archive_source(tmpdir):
+    path = str(tmpdir.join('posts.jsonl'))
+    with io.open(path, 'w', encoding='utf8') as f:
+        for day in (1, 10, 12):
+            post = dict(id='p%d' % day, created_time='2019-02-%02dT08:00:00+0000' % day, message='Meny %d' % day)
+            f.write(json.dumps(post) + '\n')
+    site = Site('technopolis', 'technopolisitfornebu', ['lunch'], None, path)
+    assert 'archive' in available_sources(site, ['archive'])
+    assert available_sources(site._replace(archive=None), ['archive']) == []
+
+    oldest = OSLO.localize(datetime.datetime(2019, 2, 5))
+    assert [post['id'] for post in archive_source(site, oldest, None)] == ['p12', 'p10']
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Check that importing the parser stays cheap"""
+
+import os
+
+import pytest
+
+from lunchbot.tests.bench_startup import import_times, median_import_time, BUDGET_MS, HEAVY
+
+
+def test_backends_imported_lazily():
+    times, modules = import_times()
+    assert 'lunchbot.main' in times
+    assert not [m for m in modules if m.split('.')[0] in HEAVY]
+
+
+# Timed, so only run when asked for, on a machine quiet enough to time on:
+@pytest.mark.skipif(not os.environ.get('LUNCHBOT_TIMING_TESTS'), reason='set LUNCHBOT_TIMING_TESTS to run')
+def test_import_within_budget():
+    median, times, _ = median_import_time(3)
+    slowest = sorted(times, key=times.get, reverse=True)[1:6]
+    assert median <= BUDGET_MS, 'Slowest imports: %s' % ', '.join(slowest)
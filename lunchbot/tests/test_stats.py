@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Test the statistics of pattern variants"""
+
+from lunchbot.stats import PatternStats, alternatives
+
+
+def test_saved_counts_add_up(tmpdir):
+    path = str(tmpdir.join('stats.sqlite'))
+    for when in ('2018-01-01', '2019-01-01', '2017-01-01'):
+        stats = PatternStats()
+        stats.load(path)
+        stats.record('a', True, 0.5, when)
+        stats.record('a', False, 0.5)
+        stats.save(path)
+
+    stats = PatternStats()
+    stats.load(path)
+    assert stats.counts('a') == (3, 3, 3.0, '2019-01-01')
+
+
+def test_alternatives_split_at_top_level():
+    assert alternatives(r'A|B(?:c|d)|[|]\|e') == ['A', 'B(?:c|d)', r'[|]\|e']
@@ -36,7 +36,6 @@ setuptools_args = {}
 setuptools_args['install_requires'] = [
     'facepy',
     'slackclient',
-    'bs4',
     'requests',
     'pytz',
 ]